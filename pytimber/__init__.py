@@ -17,6 +17,7 @@ from .LHCBWS import BWS
 from . import timberdata
 
 from .pagestore import PageStore
+from .ragged import RaggedArray
 
 from .nxcals import NXCals
 from .check_kerberos import check_kerberos
@@ -59,6 +60,7 @@ __all__ = [
     "BWS",
     "timberdata",
     "PageStore",
+    "RaggedArray",
     "NXCals",
     "check_kerberos",
 ]
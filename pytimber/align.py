@@ -0,0 +1,71 @@
+import numpy as np
+
+from .ragged import take
+
+METHODS = ("previous", "next", "nearest", "linear")
+
+
+def _numeric(rec):
+    return isinstance(rec, np.ndarray) and rec.dtype.kind in "biuf"
+
+
+def _pick(rec, k, ok):
+    # records k of rec, missing where not ok: NaN for numeric records,
+    # None otherwise
+    if _numeric(rec):
+        if len(rec) == 0:
+            return np.full(len(k), np.nan)
+        out = np.asarray(rec, dtype=float)[np.where(ok, k, 0)]
+        out[~ok] = np.nan
+        return out
+    if len(rec) == 0:
+        return [None] * len(k)
+    out = take(rec, np.where(ok, k, 0))
+    return [rr if oo else None for rr, oo in zip(out, ok)]
+
+
+def align(ts, idx, rec, method="previous", tolerance=None):
+    """Return the records rec at sorted idx aligned to the sorted ts.
+
+    method picks the "previous" or "next" record of each ts, the
+    "nearest" one (the previous one on ties), or interpolates numeric
+    scalars with "linear". Records further than tolerance from ts are
+    not used.
+    """
+    if method not in METHODS:
+        raise ValueError("Unknown alignment method %r" % (method,))
+    ts = np.asarray(ts)
+    idx = np.asarray(idx)
+    n = len(idx)
+    last = max(n - 1, 0)
+    prev = idx.searchsorted(ts, side="right") - 1
+    okprev = prev >= 0
+    prev = np.clip(prev, 0, last)
+    succ = idx.searchsorted(ts, side="left")
+    oksucc = succ < n
+    succ = np.clip(succ, 0, last)
+    if n > 0:
+        dprev = ts - idx[prev]
+        dsucc = idx[succ] - ts
+        if tolerance is not None:
+            okprev &= dprev <= tolerance
+            oksucc &= dsucc <= tolerance
+    if method == "previous":
+        return _pick(rec, prev, okprev)
+    elif method == "next":
+        return _pick(rec, succ, oksucc)
+    elif method == "nearest":
+        if n == 0:
+            return _pick(rec, prev, okprev)
+        useprev = okprev & (~oksucc | (dprev <= dsucc))
+        return _pick(rec, np.where(useprev, prev, succ), okprev | oksucc)
+    if not _numeric(rec) or np.ndim(rec) != 1:
+        raise ValueError("Linear alignment needs numeric scalar records")
+    if n == 0:
+        return np.full(len(ts), np.nan)
+    val = np.asarray(rec, dtype=float)
+    span = (idx[succ] - idx[prev]).astype(float)
+    weight = np.divide(dprev, span, out=np.zeros(len(ts)), where=span > 0)
+    out = val[prev] + weight * (val[succ] - val[prev])
+    out[~((okprev & oksucc) | (okprev & (dprev == 0)))] = np.nan
+    return out
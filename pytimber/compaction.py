@@ -0,0 +1,108 @@
+import time
+import logging
+import threading
+
+log = logging.getLogger(__name__)
+
+policies = ("size", "time", "idle")
+
+
+class Compactor(threading.Thread):
+    """Background thread compacting the variables stored in a PageStore.
+
+    policy:
+      "size": merge runs of small pages up to maxpagesize as soon as a
+              variable is stored
+      "time": as "size" but never merge pages starting in different
+              windows of window idx units
+      "idle": as "size" but only once no variable has been stored for
+              idle seconds
+    """
+
+    def __init__(self, store, policy="size", window=86400, idle=1.0):
+        threading.Thread.__init__(self, name="PageStore compactor")
+        if policy not in policies:
+            raise ValueError("Unknown compaction policy %r" % policy)
+        self.daemon = True
+        self.store = store
+        self.policy = policy
+        self.window = window if policy == "time" else None
+        self.idle = idle
+        self.queue = []
+        self.busy = False
+        self.stopped = False
+        self.last_store = time.monotonic()
+        self._cond = threading.Condition()
+
+    def __repr__(self):
+        return "Compactor(policy=%r, %d queued)" % (
+            self.policy,
+            len(self.queue),
+        )
+
+    def notify(self, variable):
+        with self._cond:
+            if variable not in self.queue:
+                self.queue.append(variable)
+            self.last_store = time.monotonic()
+            self._cond.notify_all()
+
+    def _next(self):
+        # next variable to compact, None once stopped
+        with self._cond:
+            while not self.stopped:
+                wait = None
+                if len(self.queue) > 0:
+                    if self.policy != "idle":
+                        break
+                    wait = self.last_store + self.idle - time.monotonic()
+                    if wait <= 0:
+                        break
+                self._cond.wait(wait)
+            if self.stopped:
+                return None
+            self.busy = True
+            return self.queue.pop(0)
+
+    def run(self):
+        while True:
+            variable = self._next()
+            if variable is None:
+                break
+            try:
+                start = time.monotonic()
+                before, after = self.store.compact_variable(
+                    variable, window=self.window
+                )
+                if before != after:
+                    log.info(
+                        "Compacted %s: %d pages in %d, %.3fs"
+                        % (variable, before, after, time.monotonic() - start)
+                    )
+            except Exception:
+                log.exception("Compaction of %s failed" % variable)
+            finally:
+                with self._cond:
+                    self.busy = False
+                    self._cond.notify_all()
+
+    def wait(self, timeout=None):
+        """Wait for the queue to be empty, return False on timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while len(self.queue) > 0 or self.busy:
+                if self.stopped:
+                    break
+                if deadline is not None:
+                    timeout = deadline - time.monotonic()
+                    if timeout <= 0:
+                        return False
+                self._cond.wait(timeout)
+        return True
+
+    def stop(self, wait=True):
+        with self._cond:
+            self.stopped = True
+            self._cond.notify_all()
+        if wait and self.is_alive():
+            self.join()
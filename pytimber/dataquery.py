@@ -9,6 +9,7 @@ except ImportError as e:
     print(e)
 
 from .localdate import parsedate, dumpdate
+from .ragged import concatenate
 
 
 def flattenoverlap(v, test=100, start=0):
@@ -185,7 +186,7 @@ class DataQuery(object):
             idx, val = self.data[name]
             nidx, nval = dq.data[name]
             ridx = np.concatenate([idx, nidx], axis=0)
-            rval = np.concatenate([val, nval], axis=0)
+            rval = concatenate([val, nval])
             self.data[name] = ridx, rval
 
     def extend(self, before=None, after=None, absolute=False, eps=1e-6):
@@ -208,7 +209,7 @@ class DataQuery(object):
                     idx, val = self.data[name]
                     nidx, nval = dq[name]
                     ridx = np.concatenate([idx, nidx], axis=0)
-                    rval = np.concatenate([val, nval], axis=0)
+                    rval = concatenate([val, nval])
                     self.data[name] = ridx, rval
         if before is not None:
             if type(before) is str or absolute is True:
@@ -228,7 +229,7 @@ class DataQuery(object):
                     idx, val = self.data[name]
                     nidx, nval = dq[name]
                     ridx = np.concatenate([nidx, idx], axis=0)
-                    rval = np.concatenate([nval, val], axis=0)
+                    rval = concatenate([nval, val])
                     self.data[name] = ridx, rval
         self._emptycache()
         return self
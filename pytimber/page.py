@@ -1,8 +1,19 @@
 import os
 import hashlib
+import threading
+from collections import OrderedDict
 
 import numpy as np
 
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+from .ragged import RaggedArray
+from .pagecodec import compress_blocks, read_blocks, read_bytes
+from .stats import page_stats, combine_stats
+
 
 def id_to_path(num, nchar=3):
     sss = str(num)[::-1]
@@ -11,16 +22,93 @@ def id_to_path(num, nchar=3):
     return os.path.join(*sss)
 
 
-def hashfile(sha, fpath, BUF_SIZE=65536):
+def path_to_id(path):
+    # inverse of id_to_path, None if path is not made by it
+    parts = os.path.normpath(path).split(os.sep)
+    digits = "".join([pp[1:] for pp in parts[:-1]] + parts[-1:])
+    if not digits.isdigit() or id_to_path(int(digits)) != path:
+        return None
+    return int(digits)
+
+
+def hashfile(sha, fpath, BUF_SIZE=65536, size=-1):
+    # hash the first size bytes of fpath, all of them if size < 0
     with open(fpath, "rb") as f:
-        while True:
-            data = f.read(BUF_SIZE)
+        while size != 0:
+            nbytes = BUF_SIZE if size < 0 else min(BUF_SIZE, size)
+            data = f.read(nbytes)
             if not data:
                 break
             sha.update(data)
+            size -= len(data) if size > 0 else 0
     return sha
 
 
+hashers = {
+    "md5": hashlib.md5,
+    "blake2b": lambda: hashlib.blake2b(digest_size=16),
+}
+if xxhash is not None:
+    hashers["xxh3"] = xxhash.xxh3_128
+
+# algorithm of the checksums of new pages
+HASH = "xxh3" if xxhash is not None else "blake2b"
+
+# checksums of new pages hash the digests of the page files, so that an
+# append only needs to hash the new bytes of each file
+PARTS = "-parts"
+
+# (idxpath, checksum) of the pages verified by this process, least
+# recently used first
+_verified = OrderedDict()
+_verified_size = 65536
+_verified_lock = threading.Lock()
+
+# {path: hash} of the files of the pages last written by this process by
+# (idxpath, checksum), oldest first
+_states = OrderedDict()
+_states_size = 1024
+_states_lock = threading.Lock()
+
+
+def parse_checksum(checksum):
+    # "algo:hexdigest", plain hexdigests are the md5 of legacy pages
+    algo, sep, digest = checksum.rpartition(":")
+    return (algo, digest) if sep else ("md5", digest)
+
+
+def format_checksum(algo, sha):
+    if algo == "md5":
+        return sha.hexdigest()
+    return "%s:%s" % (algo, sha.hexdigest())
+
+
+def new_hash(algo):
+    if algo.endswith(PARTS):
+        algo = algo[: -len(PARTS)]
+    return hashers[algo]()
+
+
+def combine_hashes(algo, hashes):
+    # PARTS checksum from the hashes of the page files in checksum order
+    sha = new_hash(algo)
+    for part in hashes:
+        sha.update(part.digest())
+    return format_checksum(algo, sha)
+
+
+def _save_states(key, states):
+    with _states_lock:
+        _states[key] = states
+        while len(_states) > _states_size:
+            _states.popitem(last=False)
+
+
+def _pop_states(key):
+    with _states_lock:
+        return _states.pop(key, None)
+
+
 def split_string_utf32(sss):
     sss = [a for a in sss.decode("utf-32").split("\0") if len(a) > 0]
     return sss
@@ -31,6 +119,74 @@ def split_string(sss):
     return sss
 
 
+def toscalar(val):
+    # numpy scalars to python ones, sqlite3 stores np.int64 as blobs
+    if isinstance(val, np.generic):
+        return val.item()
+    return val
+
+
+def prepare_rec(rec):
+    # records in the form they are written to disk:
+    # ndarray for fixed length records, RaggedArray otherwise
+    if isinstance(rec, RaggedArray) and rec.dtype.kind in "SU":
+        rec = rec.to_list()
+    if isinstance(rec, RaggedArray):
+        lengths = rec.lengths
+        if lengths.min() == lengths.max():
+            rec = rec.to_padded()
+    else:
+        lengths = [len(rrr) if hasattr(rrr, "__len__") else 0 for rrr in rec]
+    if isinstance(rec, RaggedArray):
+        reclen = -1
+        rectype = rec.dtype.str
+    elif len(set(lengths)) > 1:
+        reclen = -1
+        out = []
+        for rrr in rec:
+            rrr = np.array(rrr)
+            # for string, save data in zero terminated strings
+            if "S" in rrr.dtype.str:
+                nt = str(int(rrr.dtype.str[2:]) + 1)
+                rrr = np.array([rrr], dtype="S" + nt).view("S1").flatten()
+            elif "U" in rrr.dtype.str:
+                nt = str(int(rrr.dtype.str[2:]) + 1)
+                rrr = np.array([rrr], dtype="U" + nt).view("U1").flatten()
+            out.append(rrr)
+        rectypes = [rrr.dtype.str for rrr in out]
+        if len(set(rectypes)) > 1:
+            msg = "type mismatch in variable length data: %s" % rectypes
+            raise ValueError(msg)
+        rectype = rectypes[0]
+        rec = RaggedArray.from_list(out, dtype=rectype)
+    else:
+        rec = np.array(rec)
+        recsize = rec.nbytes
+        rectype = rec.dtype.str
+        if rec.ndim == 1:
+            reclen = 0
+        else:
+            reclen = rec.shape[1]
+    if reclen == -1:
+        recsize = rec.get_values().nbytes
+    return rec, rectype, reclen, int(recsize)
+
+
+def claim_pageid(pagedir, pageid):
+    """Reserve pageid creating its .idx file, False if already taken.
+
+    The file is created exclusively so that concurrent writers, in this
+    or other processes, never get the same pageid.
+    """
+    idxpath = os.path.join(pagedir, id_to_path(pageid)) + ".idx"
+    os.makedirs(os.path.dirname(idxpath), exist_ok=True)
+    try:
+        os.close(os.open(idxpath, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+    except FileExistsError:
+        return False
+    return True
+
+
 class Page(object):
     def __init__(
         self,
@@ -46,6 +202,7 @@ class Page(object):
         comp,
         checksum,
         check=False,
+        mmap=False,
     ):
         self.pageid = pageid
         self.pagedir = pagedir
@@ -58,53 +215,33 @@ class Page(object):
         self.recsize = recsize
         self.comp = comp
         self.checksum = checksum
+        self.mmap = mmap
+        # (min, max, sum, sumsq, nnan) of numeric scalar records if known
+        self.stats = None
         base = os.path.join(pagedir, id_to_path(self.pageid))
         self.pagepath = os.path.split(base)[0]
         self.recpath = os.path.join(base + ".rec")
+        self.blkpath = os.path.join(base + ".blk")
         self.idxpath = os.path.join(base + ".idx")
         if self.reclen == -1:
             self.lenpath = os.path.join(base + ".len")
-        if check and self.checksum is not None:
-            assert self.check()
+            self.offpath = os.path.join(base + ".off")
+        if check and not self.verify("always" if check is True else check):
+            msg = "Error: Checksum failed for Page %s"
+            raise IOError(msg % self.pageid)
 
     @classmethod
-    def from_data(cls, idx, rec, pagedir, pageid, comp=None):
+    def from_data(cls, idx, rec, pagedir, pageid, comp=None, segment=None):
+        """Write a new page with records rec at idx.
+
+        The page goes in its own files in pagedir, or in segment, a
+        SegmentWriter, if given.
+        """
         count = len(idx)
         if count == 0 or len(rec) != count:
             msg = "Error creating Page %s: idx,rec length mismatch %d!=%d"
             raise ValueError(msg % (pageid, len(idx), len(rec)))
-        lengths = [len(rrr) if hasattr(rrr, "__len__") else 0 for rrr in rec]
-        if len(set(lengths)) > 1:
-            reclen = -1
-            out = []
-            nlengths = []
-            for rrr in rec:
-                rrr = np.array(rrr)
-                # for string, save data in zero terminated strings
-                if "S" in rrr.dtype.str:
-                    nt = str(int(rrr.dtype.str[2:]) + 1)
-                    rrr = np.array([rrr], dtype="S" + nt).view("S1").flatten()
-                elif "U" in rrr.dtype.str:
-                    nt = str(int(rrr.dtype.str[2:]) + 1)
-                    rrr = np.array([rrr], dtype="U" + nt).view("U1").flatten()
-                out.append(rrr)
-                nlengths.append(len(rrr))
-            rec = out
-            lengths = np.array(nlengths, dtype="<i8")
-            rectypes = [rrr.dtype.str for rrr in rec]
-            if len(set(rectypes)) > 1:
-                msg = "type mismatch in variable length data: %s" % rectypes
-                raise ValueError(msg)
-            rectype = rectypes[0]
-            recsize = sum(lengths) * rec[0].dtype.itemsize
-        else:
-            rec = np.array(rec)
-            recsize = rec.nbytes
-            rectype = rec.dtype.str
-            if rec.ndim == 1:
-                reclen = 0
-            else:
-                reclen = rec.shape[1]
+        rec, rectype, reclen, recsize = prepare_rec(rec)
         idx = np.array(idx)
         idxtype = idx.dtype.str
         self = cls(
@@ -120,87 +257,340 @@ class Page(object):
             comp,
             None,
         )
+        if reclen == 0:
+            self.stats = page_stats(rec)
+        # (suffix, buffers) of the page files in checksum order
+        parts = [(".idx", [np.ascontiguousarray(idx)])]
+        if reclen == -1:
+            parts.append((".len", [rec.lengths]))
+            parts.append((".off", [rec.offsets - rec.offsets[0]]))
+            rec = rec.get_values()
+        if recsize > 0:
+            rec = np.ascontiguousarray(rec)
+            if comp is None:
+                parts.append((".rec", [rec]))
+            else:
+                parts += compress_blocks(rec, comp)
+        # the checksum is computed from the buffers being written
+        algo = HASH + PARTS
+        base = self.idxpath[: -len(".idx")]
+        states = {}
+        for suffix, buffers in parts:
+            states[base + suffix] = new_hash(algo)
+            for data in buffers:
+                states[base + suffix].update(data)
+        if recsize > 0:
+            self.checksum = combine_hashes(algo, states.values())
+            if comp is None and segment is None:
+                _save_states((self.idxpath, self.checksum), states)
+        if segment is not None:
+            self = segment.add(self, parts)
+        else:
+            self._write_files(parts)
+        if self.checksum is not None:
+            self._set_verified()
+        return self
+
+    def _write_files(self, parts):
+        # files are written under a temporary name and renamed when
+        # complete, so that a page is never seen half written
         if not os.path.isdir(self.pagepath):
             os.makedirs(self.pagepath)
-        idx.tofile(self.idxpath)
-        sha = hashlib.md5()
-        sha = hashfile(sha, self.idxpath)
-        if reclen == -1:
-            recfh = open(self.recpath, "wb")
-            lengths.tofile(self.lenpath)
-            sha = hashfile(sha, self.lenpath)
-            [rrr.tofile(recfh) for rrr in rec]
-            recfh.close()
+        base = self.idxpath[: -len(".idx")]
+        for suffix, buffers in parts:
+            with open(base + ".tmp" + suffix, "wb") as fh:
+                for data in buffers:
+                    fh.write(data)
+        for suffix, buffers in parts:
+            os.replace(base + ".tmp" + suffix, base + suffix)
+
+    def can_append(self, idxtype, rectype, reclen):
+        if self.comp is not None or self.recsize == 0:
+            return False
+        if not np.can_cast(idxtype, self.idxtype, "safe"):
+            return False
+        if rectype != self.rectype:
+            return False
+        if self.reclen == -1 and reclen > 0:
+            # strings of ragged pages are stored zero terminated
+            return np.dtype(rectype).kind not in "SU"
+        return reclen == self.reclen
+
+    def append(self, idx, rec):
+        # extend the page files in place with records newer than idxb
+        idx = np.asarray(idx)
+        ragged = isinstance(rec, RaggedArray) and rec.dtype.kind not in "SU"
+        if self.reclen == -1 and ragged:
+            # prepared ragged records stay ragged even if all their
+            # lengths are equal, e.g. all empty
+            rectype, reclen = rec.dtype.str, -1
+            recsize = rec.get_values().nbytes
         else:
-            if recsize > 0:
-                rec.tofile(self.recpath)
-        if recsize > 0:
-            sha = hashfile(sha, self.recpath)
-            if comp == "gzip":
-                os.system("gzip %s" % self.recpath)
-            self.checksum = sha.hexdigest()
+            rec, rectype, reclen, recsize = prepare_rec(rec)
+        if not self.can_append(idx.dtype, rectype, reclen):
+            msg = "Error appending to Page %s: incompatible data %s %s %d"
+            raise ValueError(msg % (self.pageid, idx.dtype, rectype, reclen))
+        if len(idx) == 0 or len(rec) != len(idx) or idx[0] <= self.idxb:
+            msg = "Error appending to Page %s: invalid index"
+            raise ValueError(msg % self.pageid)
+        if self.stats is not None:
+            self.stats = combine_stats([self.stats, page_stats(rec)])
+        algo, states = self._append_states()
+        # bytes past the sizes in the catalog are left by an append that
+        # was never committed and are overwritten
+        sizes = self.get_sizes()
+        data = [(self.idxpath, idx.astype(self.idxtype))]
+        if self.reclen == -1:
+            rec = RaggedArray.from_list(rec)
+            data.append((self.lenpath, rec.lengths))
+            if os.path.exists(self.offpath):
+                start = self.recsize // np.dtype(self.rectype).itemsize
+                offsets = rec.offsets[1:] - rec.offsets[0] + start
+                data.append((self.offpath, offsets))
+            rec = rec.get_values()
+        data.append((self.recpath, rec))
+        for path, values in data:
+            values = np.ascontiguousarray(values)
+            self._append_file(path, sizes, values)
+            states[path].update(values)
+        self.count += len(idx)
+        self.idxb = idx[-1]
+        self.recsize += recsize
+        hashes = [states[path] for path in self.get_files()]
+        self.checksum = combine_hashes(algo, hashes)
+        _save_states((self.idxpath, self.checksum), states)
+        self._set_verified()
         return self
 
+    def _append_states(self):
+        # hashes of the page files before an append, the files are only
+        # hashed again if this process did not write the page last
+        if self.checksum is not None:
+            algo = parse_checksum(self.checksum)[0]
+            if algo.endswith(PARTS):
+                states = _pop_states((self.idxpath, self.checksum))
+                if states is not None:
+                    return algo, states
+        algo = HASH + PARTS
+        states = self.get_hashes(algo)
+        if self.checksum is not None:
+            if parse_checksum(self.checksum)[0] == algo:
+                if combine_hashes(algo, states.values()) != self.checksum:
+                    msg = "Checksum failed for Page %s"
+                    raise IOError(msg % self.pageid)
+        return algo, states
+
+    def _append_file(self, path, sizes, data):
+        with open(path, "r+b") as fh:
+            fh.seek(sizes[path])
+            fh.truncate()
+            data.tofile(fh)
+
+    def _fromfile(self, path, dtype, count, offset=0):
+        # with mmap=True return a read-only view of the file, not a copy
+        if self.mmap:
+            dtype = np.dtype(dtype)
+            avail = (os.path.getsize(path) - offset) // dtype.itemsize
+            count = max(min(count, avail), 0)
+            if count == 0:
+                return np.array([], dtype=dtype)
+            return np.memmap(
+                path, dtype=dtype, mode="r", offset=offset, shape=(count,)
+            )
+        else:
+            return np.fromfile(path, dtype=dtype, count=count, offset=offset)
+
+    def _exists(self, path):
+        return os.path.exists(path)
+
+    def _read_bytes(self, path, offset=0, size=-1):
+        return read_bytes(path, offset, size)
+
+    def _hash(self, sha, path, size=-1):
+        return hashfile(sha, path, size=size)
+
+    def _mtime(self):
+        return os.path.getmtime(self.idxpath)
+
+    def _readinto(self, path, out, offset=0):
+        # fill the contiguous array out with the bytes from offset
+        with open(path, "rb") as fh:
+            fh.seek(offset)
+            nbytes = fh.readinto(memoryview(out).cast("B"))
+        if nbytes != out.nbytes:
+            msg = "Error in Page %s: not enough bytes in %s:%d!=%d"
+            raise IOError(msg % (self.pageid, path, nbytes, out.nbytes))
+        return out
+
+    def get_into(self, a, b, idx, rec):
+        """Read records a:b into the preallocated arrays idx and rec."""
+        if idx.dtype == np.dtype(self.idxtype):
+            itemsize = idx.dtype.itemsize
+            self._readinto(self.idxpath, idx, a * itemsize)
+        else:
+            idx[:] = self.get_idx_all()[a:b]
+        direct = self.comp is None and self.reclen >= 0 and self.recsize > 0
+        if direct and rec.dtype == np.dtype(self.rectype):
+            itemsize = rec.dtype.itemsize * max(self.reclen, 1)
+            self._readinto(self.recpath, rec, a * itemsize)
+        else:
+            rec[:] = self.get_rec(a, b)
+        return idx, rec
+
+    def get_offsets(self, a, b):
+        # cumulative item offsets of records a:b, length b-a+1
+        if self._exists(self.offpath):
+            off = self._fromfile(self.offpath, "<i8", b - a + 1, offset=a * 8)
+        else:
+            # pages written before .off files existed
+            lengths = self._fromfile(self.lenpath, "<i8", b)
+            off = np.zeros(b + 1, dtype="<i8")
+            np.cumsum(lengths, out=off[1:])
+            off = off[a:]
+        if len(off) != b - a + 1:
+            msg = "Error: Offset mismatch in Page %d: %d read vs %d"
+            raise IOError(msg % (self.pageid, len(off), b - a + 1))
+        return off
+
+    def _read_rec(self, start, count):
+        # read count items of rectype from item start of the .rec file
+        if self.comp is None:
+            itemsize = np.dtype(self.rectype).itemsize
+            return self._fromfile(
+                self.recpath, self.rectype, count, offset=start * itemsize
+            )
+        else:
+            return read_blocks(
+                self.recpath,
+                self.blkpath,
+                self.comp,
+                self.rectype,
+                start,
+                count,
+                reader=self._read_bytes,
+            )
+
     def get_all(self):
         return self.get_idx_all(), self.get_rec_all()
 
     def get_rec_all(self):
+        return self.get_rec(0, self.count)
+
+    def get_rec(self, a, b):
+        # read only records a:b, seeking into the .rec file
+        a = max(int(a), 0)
+        b = min(int(b), self.count)
+        cc = max(b - a, 0)
         if self.recsize == 0:
-            rec = np.array([[]] * self.count, dtype=self.rectype)
+            rec = np.array([[]] * cc, dtype=self.rectype)
         else:
-            if self.comp == "gzip":
-                os.system("gunzip %s.gz" % self.recpath)
-            cc = self.count
             reclen = self.reclen
             if reclen == -1:
-                lengths = np.fromfile(self.lenpath, dtype="<i8", count=cc)
-                recfh = open(self.recpath)
-                rec = [
-                    np.fromfile(recfh, dtype=self.rectype, count=cc)
-                    for cc in lengths
-                ]
-                recfh.close()
+                off = self.get_offsets(a, b)
+                start = int(off[0])
+                nitems = int(off[-1]) - start
+                buf = self._read_rec(start, nitems)
+                if len(buf) < nitems:
+                    msg = "Error in Page %s: not enough items:%d!=%d"
+                    raise IOError(msg % (self.pageid, len(buf), nitems))
+                rec = RaggedArray(buf, off - start)
                 if "S" in self.rectype:
                     rec = [split_string(rrr.tostring()) for rrr in rec]
+                    rec = RaggedArray.from_list(rec, dtype="S")
                 elif "U" in self.rectype:
                     rec = [split_string_utf32(rrr.tostring()) for rrr in rec]
+                    rec = RaggedArray.from_list(rec, dtype="U")
             elif reclen == 0:
-                rec = np.fromfile(self.recpath, dtype=self.rectype, count=cc)
+                rec = self._read_rec(a, cc)
             else:
-                rec = np.fromfile(
-                    self.recpath, dtype=self.rectype, count=cc * reclen
-                )
+                rec = self._read_rec(a * reclen, cc * reclen)
                 if len(rec) < cc * reclen:
                     msg = "Error in Page %s: not enough records:%d!=%d*%d"
-                    raise IOError(msg % (self.pageid, cc * reclen, cc, reclen))
+                    raise IOError(msg % (self.pageid, len(rec), cc, reclen))
                 rec = rec.reshape(cc, reclen)
-            if len(rec) != self.count:
+            if len(rec) != cc:
                 msg = "Error: Record mismatch in Page %d: %d read vs %d"
-                raise IOError(msg % (self.pageid, len(rec), self.count))
+                raise IOError(msg % (self.pageid, len(rec), cc))
         return rec
 
+    def get_slice(self, a, b):
+        # read only records a:b of both idx and rec
+        itemsize = np.dtype(self.idxtype).itemsize
+        idx = self._fromfile(self.idxpath, self.idxtype, b - a, a * itemsize)
+        if len(idx) != b - a:
+            msg = "Error: Index mismatch in Page %d: %d read vs %d"
+            raise IOError(msg % (self.pageid, len(idx), b - a))
+        return np.array(idx), self.get_rec(a, b)
+
+    def get_rec_bytes(self):
+        """Return the cumulative size in bytes of the records, of length
+        count+1, without reading them."""
+        if self.recsize == 0:
+            return np.zeros(self.count + 1, dtype="<i8")
+        itemsize = np.dtype(self.rectype).itemsize
+        if self.reclen == -1:
+            off = self.get_offsets(0, self.count)
+            return (off - off[0]) * itemsize
+        itemsize *= max(self.reclen, 1)
+        return np.arange(self.count + 1, dtype="<i8") * itemsize
+
     def get_idx_all(self):
         cc = self.count
-        idx = np.fromfile(self.idxpath, dtype=self.idxtype, count=cc)
+        idx = self._fromfile(self.idxpath, self.idxtype, cc)
         if len(idx) != cc:
             msg = "Error: Index mismatch in Page %d: %d read vs %d"
             raise IOError(msg % (self.pageid, len(idx), cc))
         return idx
 
-    def delete(self):
-        os.unlink(self.recpath)
-        os.unlink(self.idxpath)
+    def get_files(self):
+        # page files in checksum order
+        files = [self.idxpath]
         if self.reclen == -1:
-            os.unlink(self.lenpath)
+            files.append(self.lenpath)
+            if self._exists(self.offpath):
+                files.append(self.offpath)
+        if self.comp == "gzip":
+            files.append(self.recpath + ".gz")
+        elif self.comp is not None:
+            files.extend([self.blkpath, self.recpath])
+        elif self.recsize > 0:
+            files.append(self.recpath)
+        return files
+
+    def get_sizes(self):
+        """Return the size of each page file as given by the catalog, -1
+        when unknown, to which the files are checksummed.
+
+        Files can be longer while an append is not committed.
+        """
+        sizes = {}
+        for path in self.get_files():
+            suffix = path[len(self.idxpath) - len(".idx") :]
+            if suffix == ".idx":
+                sizes[path] = self.count * np.dtype(self.idxtype).itemsize
+            elif suffix == ".len":
+                sizes[path] = self.count * 8
+            elif suffix == ".off":
+                sizes[path] = (self.count + 1) * 8
+            elif suffix == ".rec" and self.comp is None:
+                sizes[path] = self.recsize
+            else:
+                sizes[path] = -1
+        return sizes
+
+    def delete(self):
+        for path in self.get_files():
+            if os.path.exists(path):
+                os.unlink(path)
 
     def _tolist(self):
-        timestamp = os.path.getmtime(self.idxpath)
+        timestamp = self._mtime()
         return [
             self.pageid,
             self.idxtype,
             self.count,
-            self.idxa,
-            self.idxb,
+            toscalar(self.idxa),
+            toscalar(self.idxb),
             self.rectype,
             self.reclen,
             self.recsize,
@@ -210,10 +600,10 @@ class Page(object):
         ]
 
     def get(self, idxa, idxb, skip=1):
-        idx, rec = self.get_all()
+        idx = self.get_idx_all()
         a = idx.searchsorted(idxa, side="left")
         b = idx.searchsorted(idxb, side="right")
-        return idx[a:b:skip], rec[a:b:skip]
+        return idx[a:b:skip], self.get_rec(a, b)[::skip]
 
     def get_idx(self, idxa, idxb, skip=1):
         idx = self.get_idx_all()
@@ -233,25 +623,72 @@ class Page(object):
     def get_recsize(self, idxa, idxb, skip=1):
         if self.reclen >= 0:
             itemsize = self.recsize / self.count
-            return self.count(idxa, idxb, skip=skip) * itemsize
+            return self.get_count(idxa, idxb, skip=skip) * itemsize
         else:
-            cc = self.count
             a, b = self.get_range(idxa, idxb)
-            items = np.sum(
-                np.fromfile(self.lenpath, dtype="<i8", count=cc)[a:b:skip]
-            )
-            return items * np.dtype(self.rectype).itemsize
+            if b <= a:
+                return 0
+            off = self.get_offsets(a, b)
+            if skip == 1:
+                items = off[-1] - off[0]
+            else:
+                items = np.sum(np.diff(off)[::skip])
+            return int(items) * np.dtype(self.rectype).itemsize
+
+    def get_checksum(self, algo=None):
+        # same algorithm as the stored checksum unless specified
+        if algo is None:
+            algo = HASH
+            if self.checksum is not None:
+                algo = parse_checksum(self.checksum)[0]
+        if algo.endswith(PARTS):
+            return combine_hashes(algo, self.get_hashes(algo).values())
+        sha = hashers[algo]()
+        for path, size in self.get_sizes().items():
+            sha = self._hash(sha, path, size)
+        return format_checksum(algo, sha)
+
+    def get_hashes(self, algo):
+        # hash of each page file for PARTS checksums
+        return {
+            path: self._hash(new_hash(algo), path, size)
+            for path, size in self.get_sizes().items()
+        }
 
     def check(self):
-        sha = hashlib.md5()
-        sha = hashfile(sha, self.idxpath)
-        if self.reclen == -1:
-            sha = hashfile(sha, self.lenpath)
-        if self.comp == "gzip":
-            sha = hashfile(sha, self.recpath + ".gz")
-        else:
-            sha = hashfile(sha, self.recpath)
-        res = sha.hexdigest() == self.checksum
+        res = self.get_checksum() == self.checksum
         if res is False:
             print("Checksum failsed for page %s" % self.pageid)
         return res
+
+    def verify(self, policy="always"):
+        """Check the page files against the checksum.
+
+        policy: "always", "once" per process, "never" or "scrub" where
+        only PageStore.scrub checks pages.
+        """
+        if policy not in ("always", "once", "never", "scrub"):
+            raise ValueError("Unknown verify policy %r" % policy)
+        if self.checksum is None or policy in ("never", "scrub"):
+            return True
+        if policy == "once" and self._is_verified():
+            return True
+        res = self.check()
+        if res:
+            self._set_verified()
+        return res
+
+    def _is_verified(self):
+        key = (self.idxpath, self.checksum)
+        with _verified_lock:
+            if key in _verified:
+                _verified.move_to_end(key)
+                return True
+        return False
+
+    def _set_verified(self):
+        with _verified_lock:
+            _verified[(self.idxpath, self.checksum)] = True
+            _verified.move_to_end((self.idxpath, self.checksum))
+            while len(_verified) > _verified_size:
+                _verified.popitem(last=False)
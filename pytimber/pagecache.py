@@ -0,0 +1,90 @@
+import threading
+from collections import OrderedDict
+
+
+def _nbytes(data):
+    return sum(getattr(dd, "nbytes", 0) for dd in data)
+
+
+def _freeze(data):
+    # cached arrays are shared with the callers, make them read-only
+    for dd in data:
+        for arr in (dd, getattr(dd, "values", None)):
+            if hasattr(arr, "flags"):
+                arr.flags.writeable = False
+    return data
+
+
+class PageCache(object):
+    """LRU cache of decoded (idx, rec) pages within a byte budget.
+
+    Keys are (pageid, checksum) so that a rewritten page never hits a
+    stale entry.
+    """
+
+    def __init__(self, maxbytes):
+        self.maxbytes = maxbytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return "PageCache(%d/%d bytes, %d pages, %d hits, %d misses)" % (
+            self.nbytes,
+            self.maxbytes,
+            len(self._data),
+            self.hits,
+            self.misses,
+        )
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key):
+        with self._lock:
+            data = self._data.get(key)
+            if data is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return data[0]
+
+    def put(self, key, value):
+        nbytes = _nbytes(value)
+        if nbytes > self.maxbytes:
+            return value
+        value = _freeze(value)
+        with self._lock:
+            if key in self._data:
+                self.nbytes -= self._data.pop(key)[1]
+            self._data[key] = (value, nbytes)
+            self.nbytes += nbytes
+            while self.nbytes > self.maxbytes:
+                self.nbytes -= self._data.popitem(last=False)[1][1]
+                self.evictions += 1
+        return value
+
+    def invalidate(self, pageid):
+        with self._lock:
+            for key in [key for key in self._data if key[0] == pageid]:
+                self.nbytes -= self._data.pop(key)[1]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.nbytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "pages": len(self._data),
+                "nbytes": self.nbytes,
+                "maxbytes": self.maxbytes,
+            }
@@ -0,0 +1,131 @@
+import zlib
+import lzma
+import gzip
+
+import numpy as np
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+
+# uncompressed bytes per block, a block is the unit of partial reads
+BLOCKSIZE = 2**20
+
+codecs = {}
+
+
+def register_codec(name, compress, decompress):
+    codecs[name] = (compress, decompress)
+
+
+register_codec("zlib", zlib.compress, zlib.decompress)
+register_codec("lzma", lzma.compress, lzma.decompress)
+if zstandard is not None:
+    register_codec(
+        "zstd",
+        lambda data: zstandard.ZstdCompressor().compress(data),
+        lambda data: zstandard.ZstdDecompressor().decompress(data),
+    )
+if lz4 is not None:
+    register_codec("lz4", lz4.frame.compress, lz4.frame.decompress)
+
+
+def parse_comp(comp):
+    # "zlib", "zlib+shuffle", ... -> ("zlib", shuffle)
+    name, _, filt = comp.partition("+")
+    if name not in codecs:
+        raise ValueError("Unknown compression codec %r" % name)
+    if filt not in ("", "shuffle"):
+        raise ValueError("Unknown compression filter %r" % filt)
+    return name, filt == "shuffle"
+
+
+def shuffle(data, itemsize):
+    # group the n-th bytes of all items together
+    if itemsize == 1:
+        return data
+    buf = np.frombuffer(data, dtype="u1").reshape(-1, itemsize)
+    return buf.T.tobytes()
+
+
+def unshuffle(data, itemsize):
+    if itemsize == 1:
+        return data
+    buf = np.frombuffer(data, dtype="u1").reshape(itemsize, -1)
+    return buf.T.tobytes()
+
+
+def compress_blocks(values, comp):
+    """Compress values in blocks, return the parts of the page as
+    (suffix, buffers) in checksum order.
+
+    The .blk part holds the number of items per block followed by the
+    byte offsets of the compressed blocks in the .rec part.
+    """
+    if comp == "gzip":
+        # legacy whole-file compression, not block addressable
+        return [(".rec.gz", [gzip.compress(values.tobytes())])]
+    name, shuf = parse_comp(comp)
+    compress = codecs[name][0]
+    values = np.ascontiguousarray(values).ravel()
+    itemsize = values.dtype.itemsize
+    blockitems = max(BLOCKSIZE // itemsize, 1)
+    offsets = [blockitems, 0]
+    blocks = []
+    for i in range(0, len(values), blockitems):
+        data = values[i : i + blockitems].tobytes()
+        if shuf:
+            data = shuffle(data, itemsize)
+        data = compress(data)
+        blocks.append(data)
+        offsets.append(offsets[-1] + len(data))
+    return [(".blk", [np.array(offsets, dtype="<i8")]), (".rec", blocks)]
+
+
+def read_bytes(path, offset=0, size=-1):
+    with open(path, "rb") as fh:
+        fh.seek(offset)
+        return fh.read(size)
+
+
+def read_blocks(
+    recpath, blkpath, comp, dtype, start, count, reader=read_bytes
+):
+    """Read count items of dtype from start decompressing only the
+    blocks that hold them.
+
+    reader(path, offset, size) returns the bytes of the page files.
+    """
+    dtype = np.dtype(dtype)
+    if count <= 0:
+        return np.array([], dtype=dtype)
+    if comp == "gzip":
+        data = gzip.decompress(reader(recpath + ".gz", 0, -1))
+        return np.frombuffer(data, dtype=dtype)[start : start + count].copy()
+    name, shuf = parse_comp(comp)
+    decompress = codecs[name][1]
+    blk = np.frombuffer(reader(blkpath, 0, -1), dtype="<i8")
+    blockitems, offsets = int(blk[0]), blk[1:]
+    ka = start // blockitems
+    kb = min(-(-(start + count) // blockitems), len(offsets) - 1)
+    size = int(offsets[kb] - offsets[ka])
+    raw = memoryview(reader(recpath, int(offsets[ka]), size))
+    values = np.empty((kb - ka) * blockitems, dtype=dtype)
+    base = offsets[ka]
+    pos = 0
+    for k in range(ka, kb):
+        data = decompress(raw[offsets[k] - base : offsets[k + 1] - base])
+        if shuf:
+            data = unshuffle(data, dtype.itemsize)
+        data = np.frombuffer(data, dtype=dtype)
+        values[pos : pos + len(data)] = data
+        pos += len(data)
+    a = start - ka * blockitems
+    return values[a : min(a + count, pos)]
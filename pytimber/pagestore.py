@@ -1,46 +1,87 @@
 import os
 import sys
+import time
+import argparse
+import zlib
 import shutil
-import tempfile
+import logging
+import threading
+from urllib.request import pathname2url
+from functools import partial
+from contextlib import contextmanager
+from concurrent.futures import Future, ThreadPoolExecutor
 
 import sqlite3
 import numpy as np
 
-from .page import Page
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from .page import Page, claim_pageid, path_to_id, prepare_rec, toscalar
+from .ragged import RaggedArray, concatenate, take
+from .pagecache import PageCache
+from .compaction import Compactor
+from . import pyramid, partition as partitions
+from .stats import STAT_FIELDS, page_stats, combine_stats, to_stat
+from .stats import parse_predicate
+from .segment import SegmentWriter, SegmentPage, list_segments, lock_segment
+from .segment import format_parts, parse_parts, segment_path
+from .pagecodec import read_bytes
+from .align import METHODS, align
+
+# columns added to the pages table after its creation, in order
+_new_columns = [
+    ("vmin", "NUMERIC"),
+    ("vmax", "NUMERIC"),
+    ("vsum", "NUMERIC"),
+    ("vsumsq", "NUMERIC"),
+    ("nnan", "INTEGER"),
+    ("segment", "INTEGER"),
+    ("segparts", "STRING"),
+]
+
+log = logging.getLogger(__name__)
 
 
 def isstr(s):
     return isinstance(s, str)
 
 
+def readonly_uri(dbname, readonly=True):
+    # readonly="immutable" for catalogs that no process is writing to
+    if dbname.startswith("file:"):
+        uri = dbname
+    else:
+        uri = "file:" + pathname2url(os.path.abspath(dbname))
+    params = ["mode=ro", "cache=shared"]
+    if readonly == "immutable":
+        params.append("immutable=1")
+    return uri + ("&" if "?" in uri else "?") + "&".join(params)
+
+
 def merge(idx0, rec0, idx1, rec1):
-    sel = {}
-    val = [rec0, rec1]
-    for ii, iv in enumerate(idx0):
-        sel[iv] = (0, ii)
-    for ii, iv in enumerate(idx1):
-        sel[iv] = (1, ii)
-    idx = []
-    rec = []
-    for sv, (ir, ii) in sorted(sel.items()):
-        idx.append(sv)
-        rec.append(val[ir][ii])
-    return idx, rec
-
-
-def concatenate(val):
-    try:
-        return np.concatenate(val)
-    except ValueError:
-        out = []
-        for vv in val:
-            out.extend(vv)
-        return out
+    # sorted union, for duplicated idx the last record of idx1 wins
+    idx = np.concatenate([idx0, idx1])
+    order = np.argsort(idx, kind="stable")
+    idx = idx[order]
+    last = np.ones(len(idx), dtype=bool)
+    last[:-1] = idx[1:] != idx[:-1]
+    rec = take(concatenate([rec0, rec1]), order[last])
+    return idx[last], rec
 
 
 _suffixes = ["bytes", "KiB", "MiB", "GiB", "TiB", "EiB", "ZiB"]
 
 
+def truncate(sizes):
+    # undo appends to page files given their {path: size} before
+    for path, size in sizes.items():
+        if os.path.exists(path):
+            os.truncate(path, size)
+
+
 def human_readable(size, suffixes=" kMGTEZ"):
     order = int(np.log10(size) / 3) if size else 0
     return (
@@ -50,8 +91,8 @@ def human_readable(size, suffixes=" kMGTEZ"):
 
 class PageStore(object):
     def __repr__(self):
-        fmt = "PageStore(%r,pagedir=%r,maxpagesize=%r)"
-        return fmt % (self.dbname, self.pagedir, self.maxpagesize)
+        fmt = "PageStore(%r,pagedir=%r,maxpagesize=%r,mmap=%r)"
+        return fmt % (self.dbname, self.pagedir, self.maxpagesize, self.mmap)
 
     def __init__(
         self,
@@ -61,32 +102,119 @@ class PageStore(object):
         checksum=False,
         keep_deleted_pages=False,
         readonly=False,
+        mmap=False,
+        comp=None,
+        timeout=60.0,
+        workers=None,
+        verify="once",
+        cache=None,
+        levels=None,
+        segmentsize=None,
+        compaction="sync",
+        partition=None,
+        grace=60.0,
     ):
+        self.readonly = readonly
+        self.dbname = dbname
+        self.timeout = timeout
+        self.workers = workers
+        self._local = threading.local()
+        self._mutex = threading.Lock()
+        self._connections = []
+        self._writers = []
+        self._executor = None
+        self._varlocks = {}
+        self._bulk = None
         try:
-            if dbname.startswith("file:"):
-                if readonly:
-                    dbname += "?mode=ro"
-                self.db = sqlite3.connect(
-                    dbname, isolation_level="IMMEDIATE", uri=True
-                )
-            else:
-                if readonly:
-                    tmp = tempfile.mktemp()
-                    shutil.copy2(dbname, tmp)
-                    dbname = tmp
-                self.db = sqlite3.connect(dbname, isolation_level="IMMEDIATE")
+            self.db
         except sqlite3.Error as e:
-            print(e.msg)
+            print(e)
             print("Error creating database %s" % dbname)
             sys.exit(1)
-        self.dbname = dbname
-        self.create_db()
+        if not readonly:
+            self.create_db()
         self.set_pagedir(pagedir)
+        self._pagecols = self.page_select()
+        self.segdir = os.path.join(self.pagedir, "segments")
+        self.set_segmentsize(segmentsize)
+        self.set_partition(partition)
         self.set_var("maxpagesize", maxpagesize, 2 ** 24)
+        self.set_var("comp", comp)
         self.checksum = checksum
         self.keep_deleted_pages = keep_deleted_pages
+        # seconds the files of deleted pages are kept for the readers that
+        # listed them before, 0 to unlink them at commit
+        self.grace = grace
+        self.mmap = mmap
+        self.verify = verify
+        # byte budget of the cache of decoded pages, None for no cache
+        self.cache = PageCache(cache) if cache else None
+        self.set_levels(levels)
+        self._lastid = 0
+        self._lockfile = None
+        self.compactor = None
+        self.set_compaction(compaction)
+        if verify == "scrub":
+            self.scrub(background=True)
+
+    @property
+    def db(self):
+        # sqlite3 connections cannot be shared, each thread gets its own
+        db = getattr(self._local, "db", None)
+        if db is None:
+            if self.readonly:
+                db = sqlite3.connect(
+                    readonly_uri(self.dbname, self.readonly),
+                    isolation_level="IMMEDIATE",
+                    uri=True,
+                    timeout=self.timeout,
+                    check_same_thread=False,
+                )
+            else:
+                db = sqlite3.connect(
+                    self.dbname,
+                    isolation_level="IMMEDIATE",
+                    uri=self.dbname.startswith("file:"),
+                    timeout=self.timeout,
+                    check_same_thread=False,
+                )
+            with self._mutex:
+                self._connections.append(db)
+            self._local.db = db
+            if self.readonly:
+                self.open_readonly_db()
+        return db
+
+    @property
+    def _bulk(self):
+        # a bulk transaction belongs to the thread, and connection, that
+        # started it
+        return getattr(self._local, "bulk", None)
+
+    @_bulk.setter
+    def _bulk(self, value):
+        self._local.bulk = value
+
+    def close(self):
+        if self.compactor is not None:
+            self.compactor.stop()
+            self.compactor = None
+        with self._mutex:
+            for db in self._connections:
+                db.close()
+            self._connections = []
+            for writer in self._writers:
+                writer.close()
+            self._writers = []
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+        self._local = threading.local()
 
     def create_db(self):
+        # WAL lets readers go on while a writer, possibly in another
+        # process, holds the write lock
+        self.db.execute("PRAGMA journal_mode=WAL")
         sql = """
         CREATE TABLE IF NOT EXISTS pages(
               name   STRING,
@@ -101,16 +229,116 @@ class PageStore(object):
               comp    STRING,
               created NUMERIC,
               checksum STRING,
-              deleted NUMERIC);
+              deleted NUMERIC,
+              vmin    NUMERIC,
+              vmax    NUMERIC,
+              vsum    NUMERIC,
+              vsumsq  NUMERIC,
+              nnan    INTEGER,
+              segment INTEGER,
+              segparts STRING);
         CREATE INDEX IF NOT EXISTS page_index ON pages(pageid);
+        CREATE INDEX IF NOT EXISTS page_idxa_index ON pages(name,idxa,idxb);
+        CREATE INDEX IF NOT EXISTS page_idxb_index ON pages(name,idxb);
         CREATE TABLE IF NOT EXISTS conf(
               variable STRING,
               value   STRING,
               timestamp STRING);"""
         self.db.executescript(sql)
+        self.add_columns()
+        sql = """CREATE INDEX IF NOT EXISTS page_segment_index
+               ON pages(segment)"""
+        self.db.execute(sql)
+        sql = """CREATE INDEX IF NOT EXISTS page_deleted_index
+               ON pages(deleted) WHERE deleted IS NOT NULL"""
+        self.db.execute(sql)
+        self.decode_blob_bounds()
+        self.create_variables_table()
         self.db.commit()
         return self
 
+    def page_columns(self):
+        return [row[1] for row in self.db.execute("PRAGMA table_info(pages)")]
+
+    def has_stats_columns(self):
+        return STAT_FIELDS[0] in self.page_columns()
+
+    def add_columns(self):
+        # catalogs created before the per page statistics and segments,
+        # the statistics of their pages are NULL and computed from the
+        # records on demand, their pages are in files
+        columns = self.page_columns()
+        for name, sqltype in _new_columns:
+            if name not in columns:
+                sql = "ALTER TABLE pages ADD COLUMN %s %s" % (name, sqltype)
+                self.db.execute(sql)
+
+    def decode_blob_bounds(self):
+        # catalogs written before the bounds went through toscalar hold
+        # numpy idxa/idxb as blobs, which do not compare with numbers
+        if self.get_var("scalarbounds") is not None:
+            return
+        sql = """SELECT pageid,idxtype,idxa,idxb FROM pages
+               WHERE typeof(idxa)=='blob' OR typeof(idxb)=='blob'"""
+        rows = list(self.db.execute(sql))
+        for pageid, idxtype, idxa, idxb in rows:
+            idxa, idxb = [
+                (
+                    np.frombuffer(val, dtype=idxtype)[0].item()
+                    if isinstance(val, bytes)
+                    else val
+                )
+                for val in (idxa, idxb)
+            ]
+            sql = "UPDATE pages SET idxa=?,idxb=? WHERE pageid==?"
+            self.db.execute(sql, [idxa, idxb, pageid])
+        if len(rows) > 0:
+            # rebuilt from the decoded bounds by create_variables_table
+            self.db.execute("DROP TABLE IF EXISTS variables")
+        sql = "INSERT INTO conf VALUES (?,?,datetime('now'))"
+        self.db.execute(sql, ["scalarbounds", "1"])
+
+    def open_readonly_db(self):
+        # no schema changes on a read-only catalog, stores created before
+        # the variables table get an equivalent temporary view
+        cur = self.db.cursor()
+        sql = """SELECT name FROM sqlite_master
+               WHERE type='table' AND name='variables'"""
+        if cur.execute(sql).fetchone() is None:
+            sql = """
+            CREATE TEMP VIEW variables AS
+            SELECT name,MIN(idxa) AS idxa,MAX(idxb) AS idxb,
+                   SUM(count) AS count,SUM(recsize) AS recsize,
+                   COUNT(*) AS npages,idxtype,rectype,reclen
+            FROM pages WHERE deleted IS NULL GROUP BY name"""
+            cur.execute(sql)
+        return self
+
+    def create_variables_table(self):
+        # per variable summary of the live pages, kept up to date by
+        # _insert_page, _update_page and _delete_page
+        cur = self.db.cursor()
+        sql = """SELECT name FROM sqlite_master
+               WHERE type='table' AND name='variables'"""
+        if cur.execute(sql).fetchone() is not None:
+            return
+        sql = """
+        CREATE TABLE variables(
+              name    STRING PRIMARY KEY,
+              idxa    NUMERIC,
+              idxb    NUMERIC,
+              count   INTEGER,
+              recsize INTEGER,
+              npages  INTEGER,
+              idxtype STRING,
+              rectype STRING,
+              reclen  INTEGER);
+        INSERT INTO variables
+        SELECT name,MIN(idxa),MAX(idxb),SUM(count),SUM(recsize),COUNT(*),
+               idxtype,rectype,reclen
+        FROM pages WHERE deleted IS NULL GROUP BY name;"""
+        self.db.executescript(sql)
+
     def set_var(self, name, value, default=None):
         if value is None:
             value = self.get_var(name)
@@ -128,7 +356,7 @@ class PageStore(object):
     def set_pagedir(self, dirpath):
         if dirpath is None:
             dirpath = self.get_var("pagedir", "data")
-        if not os.path.isdir(dirpath):
+        if not os.path.isdir(dirpath) and not self.readonly:
             os.mkdir(dirpath)
         dirpath = os.path.abspath(dirpath)
         self.set_var("pagedir", dirpath)
@@ -136,13 +364,177 @@ class PageStore(object):
     def get_var(self, name, default=None):
         cur = self.db.cursor()
         sql = """SELECT value FROM conf
-               WHERE variable=? ORDER BY timestamp DESC LIMIT 1"""
+               WHERE variable=? ORDER BY timestamp DESC,rowid DESC LIMIT 1"""
         ret = cur.execute(sql, (name,)).fetchone()
         if ret:
             return ret[0]
         else:
             return default
 
+    def set_levels(self, levels=None):
+        """Set the bucket sizes of the aggregate levels maintained for the
+        numeric scalar variables, e.g. [1, 60, 3600, 86400].
+
+        The levels are saved in the catalog, None uses the saved ones.
+        """
+        saved = self.get_var("levels", "")
+        if levels is not None:
+            levels = ",".join("%g" % bb for bb in pyramid.parse_levels(levels))
+            if levels != saved and not self.readonly:
+                self.store_var("levels", levels)
+        else:
+            # a single level is read back as a number
+            levels = str(saved)
+        self.levels = pyramid.parse_levels(levels)
+
+    def set_compaction(self, compaction="sync", window=86400, idle=1.0):
+        """Set how variables are rebalanced after a store.
+
+        compaction:
+          "sync": in store_variable, ingestion time grows with the number
+                  of small pages
+          "size", "time" or "idle": in a background thread with the
+                  given Compactor policy, using window or idle
+          None: only when rebalance or compact_variable are called
+        """
+        if self.compactor is not None:
+            self.compactor.stop()
+            self.compactor = None
+        if compaction not in ("sync", None):
+            self.compactor = Compactor(self, compaction, window, idle)
+            self.compactor.start()
+        self.compaction = compaction
+
+    def set_segmentsize(self, segmentsize=None):
+        """Store new pages in segment files of about segmentsize bytes
+        instead of one set of files per page, 0 for the latter.
+
+        The value is saved in the catalog, None uses the saved one.
+        """
+        saved = self.get_var("segmentsize", "0")
+        if segmentsize is not None:
+            if str(segmentsize) != saved and not self.readonly:
+                self.store_var("segmentsize", str(segmentsize))
+        else:
+            segmentsize = saved
+        self.segmentsize = int(segmentsize)
+
+    def set_partition(self, partition=None):
+        """Never let pages cross the boundaries of partition: "hour" or
+        "day" (UTC, for idx in seconds), a width in idx units or a list of
+        boundaries such as fill start times, "" for no partitioning.
+
+        Pages stored before keep their extent. The value is saved in the
+        catalog, None uses the saved one.
+        """
+        saved = self.get_var("partition", "")
+        if partition is not None:
+            spec = partitions.parse_partition(partition)
+            value = partitions.format_partition(spec)
+            if value != saved and not self.readonly:
+                self.store_var("partition", value)
+        else:
+            spec = partitions.parse_partition(saved)
+        self.partition = spec
+
+    def segment_path(self, segid):
+        return segment_path(self.segdir, segid)
+
+    def _segment_writer(self):
+        # each thread appends to its own segment, a new one once full
+        writer = getattr(self._local, "segment", None)
+        if writer is not None and writer.size >= self.segmentsize:
+            if self._bulk is None:
+                self._close_writer(writer)
+            else:
+                # segments holding staged pages stay locked until the bulk
+                # ends, compaction would find them without live pages
+                self._bulk["segments"].append(writer)
+            writer = None
+        if writer is None:
+            # page ids are made of the segment id, never reuse one
+            minid = (self.get_last_pageid() >> 32) + 1
+            writer = SegmentWriter(self.segdir, minid)
+            with self._mutex:
+                self._writers.append(writer)
+            self._local.segment = writer
+        return writer
+
+    def _close_writer(self, writer):
+        with self._mutex:
+            self._writers.remove(writer)
+        writer.close()
+
+    def compact_segments(self, threshold=0.5):
+        """Move the pages out of the segment files with more than threshold
+        of their size unused and delete them, return the bytes reclaimed.
+
+        Segments being written by any PageStore are left alone, as are
+        those with pages deleted less than grace seconds ago. The files
+        of compacted segments are deleted grace seconds later.
+        """
+        if self._bulk is not None:
+            raise ValueError("Cannot compact segments inside bulk")
+        reclaimed = 0
+        limit = time.time() - self.grace
+        for segid, path in sorted(list_segments(self.segdir).items()):
+            fh = lock_segment(path)
+            if fh is None:
+                continue
+            try:
+                sql = """SELECT pageid,segparts,deleted FROM pages
+                       WHERE segment==?"""
+                rows = list(self.db.execute(sql, [segid]))
+                if len(rows) == 0:
+                    # compacted earlier, readers are done with it once
+                    # grace has passed since
+                    if os.path.getmtime(path) < limit:
+                        os.unlink(path)
+                    continue
+                pages = []
+                dropped = []
+                for pageid, segparts, deleted in rows:
+                    # the deleted pages go with the segment
+                    if deleted is None or self.keep_deleted_pages:
+                        pages.append((pageid, parse_parts(segparts)))
+                    elif float(deleted) < limit:
+                        dropped.append(pageid)
+                    else:
+                        break
+                if len(pages) + len(dropped) < len(rows):
+                    continue
+                size = os.path.getsize(path)
+                live = sum(
+                    psize
+                    for pageid, parts in pages
+                    for offset, psize in parts.values()
+                )
+                if size > 0 and size - live <= threshold * size:
+                    continue
+                for pageid, parts in pages:
+                    data = [
+                        (suffix, [read_bytes(path, offset, psize)])
+                        for suffix, (offset, psize) in parts.items()
+                    ]
+                    writer = self._segment_writer()
+                    parts = format_parts(writer.write(data))
+                    sql = """UPDATE pages SET segment=?,segparts=?
+                           WHERE pageid==?"""
+                    self.db.execute(sql, [writer.segid, parts, pageid])
+                sql = "DELETE FROM pages WHERE pageid==?"
+                self.db.executemany(sql, [[pageid] for pageid in dropped])
+                self.db.commit()
+                if self.grace > 0:
+                    # deleted by a later compaction
+                    os.utime(path)
+                else:
+                    os.unlink(path)
+            finally:
+                fh.close()
+            log.info("Compacted %s, %d bytes reclaimed" % (path, size - live))
+            reclaimed += size - live
+        return reclaimed
+
     def get_vars(self):
         cur = self.db.cursor()
         sql = """SELECT * FROM conf
@@ -154,57 +546,430 @@ class PageStore(object):
         cur = self.db.cursor()
         lastid = cur.execute("SELECT MAX(pageid) FROM pages").fetchone()[0]
         if lastid is None:
-            return 0
-        return lastid
+            lastid = 0
+        return max(lastid, self._lastid)
+
+    def new_pageid(self):
+        # pageids are reserved on disk, MAX(pageid) alone would give the
+        # same id to writers whose pages are not committed yet
+        pageid = self.get_last_pageid() + 1
+        while not claim_pageid(self.pagedir, pageid):
+            pageid += 1
+        with self._mutex:
+            self._lastid = max(self._lastid, pageid)
+        return pageid
+
+    @contextmanager
+    def lock(self, variable):
+        """Lock variable against the other threads and, with an advisory
+        lock, the other processes writing in the same pagedir.
+
+        Inside bulk the lock is held until commit.
+        """
+        if self.readonly:
+            yield
+            return
+        pos = zlib.crc32(variable.encode("utf-8"))
+        if self._bulk is not None:
+            if pos not in self._bulk["locks"]:
+                self._acquire(pos)
+                self._bulk["locks"].add(pos)
+            yield
+            return
+        self._acquire(pos)
+        try:
+            yield
+        finally:
+            self._release(pos)
+
+    def _acquire(self, pos):
+        # fcntl locks belong to the process, threads need their own lock
+        with self._mutex:
+            varlock = self._varlocks.setdefault(pos, threading.Lock())
+            if fcntl is not None and self._lockfile is None:
+                path = os.path.join(self.pagedir, ".lock")
+                self._lockfile = open(path, "a")
+        varlock.acquire()
+        if fcntl is not None:
+            fcntl.lockf(self._lockfile, fcntl.LOCK_EX, 1, pos)
+
+    def _release(self, pos):
+        if fcntl is not None:
+            fcntl.lockf(self._lockfile, fcntl.LOCK_UN, 1, pos)
+        self._varlocks[pos].release()
+
+    def _unlock_all(self, locks):
+        for pos in locks:
+            self._release(pos)
+
+    def _commit(self):
+        if self._bulk is None:
+            self.db.commit()
+
+    @contextmanager
+    def bulk(self, rebalance="deferred", workers=None):
+        """Group stores in a single transaction.
+
+        The page files are written first and the catalog changes staged,
+        the transaction only applies them and commits at the end. Reading
+        a variable stored in the bulk applies its changes earlier.
+
+        rebalance: "deferred" rebalances the variables stored once after
+        the commit, each in its own transaction, "immediate" after each
+        store_variable, None never.
+        workers: number of threads writing page files in the background.
+        """
+        if self._bulk is not None:
+            yield self
+            return
+        self._bulk = {
+            "rebalance": rebalance,
+            "touched": set(),
+            "levels": {},
+            "staged": {},
+            "deleted": [],
+            "written": [],
+            "appended": [],
+            "segments": [],
+            "locks": set(),
+            "executor": ThreadPoolExecutor(workers) if workers else None,
+        }
+        try:
+            yield self
+            self._flush_staged()
+            self.db.commit()
+            deleted = self._bulk["deleted"]
+            touched = sorted(self._bulk["touched"])
+            levels = sorted(self._bulk["levels"].items())
+        except BaseException:
+            self.db.rollback()
+            for item in self._bulk["written"]:
+                if isinstance(item, Future):
+                    if item.exception() is not None:
+                        continue
+                    item = item.result()
+                item.delete()
+            for sizes in self._bulk["appended"]:
+                truncate(sizes)
+            raise
+        finally:
+            if self._bulk["executor"] is not None:
+                self._bulk["executor"].shutdown()
+            for writer in self._bulk["segments"]:
+                self._close_writer(writer)
+            self._unlock_all(self._bulk["locks"])
+            self._bulk = None
+        for page in deleted:
+            page.delete()
+        self.reclaim()
+        for variable in touched:
+            if self.compactor is not None:
+                self.compactor.notify(variable)
+            else:
+                self.compact_variable(variable)
+        for variable, (idxa, idxb) in levels:
+            with self.lock(variable):
+                self.update_levels(variable, idxa, idxb)
+
+    def _stage(self, variable, op, page):
+        # catalog change applied by _flush_staged
+        self._bulk["staged"].setdefault(variable, []).append((op, page))
+
+    def _flush_staged(self, variable=None):
+        # apply the staged catalog changes, in order, pages written in the
+        # background are waited for
+        if self._bulk is None:
+            return
+        staged = self._bulk["staged"]
+        variables = list(staged) if variable is None else [variable]
+        for variable in variables:
+            ops = staged.get(variable, [])
+            while len(ops) > 0:
+                op, page = ops[0]
+                if op == "insert":
+                    if isinstance(page, Future):
+                        page = page.result()
+                    self._insert_page(variable, page)
+                elif op == "update":
+                    self._update_page(page)
+                else:
+                    self._delete_page(page)
+                ops.pop(0)
+            staged.pop(variable, None)
+
+    def bulk_store(self, data, rebalance="deferred", workers=None):
+        with self.bulk(rebalance=rebalance, workers=workers):
+            for variable, (idx, rec) in data.items():
+                self.store_variable(variable, idx, rec)
 
     def delete(self):
+        if self.readonly:
+            raise ValueError("Cannot delete a read-only PageStore")
+        self.set_compaction(None)
         if os.path.exists(self.pagedir):
             shutil.rmtree(self.pagedir)
-        os.unlink(self.dbname)
+        self.close()
+        for suffix in ["", "-wal", "-shm"]:
+            if os.path.exists(self.dbname + suffix):
+                os.unlink(self.dbname + suffix)
 
     def store_page(self, variable, idx, rec, commit=True):
+        if self.readonly:
+            raise ValueError("Cannot store into a read-only PageStore")
         # print("Store page %s"%variable)
-        pageid = self.get_last_pageid() + 1
-        page = Page.from_data(idx, rec, self.pagedir, pageid)
-        sql = """INSERT INTO pages VALUES
-             (?,?,?,?,?,?,?,?,?,?,?,?,?)"""
-        self.db.execute(sql, [variable] + page._tolist() + [None])
+        if self.partition is not None:
+            cuts = partitions.slices(self.partition, idx)
+            if len(cuts) > 1:
+                for a, b in cuts:
+                    self.store_page(variable, idx[a:b], rec[a:b], False)
+                if commit:
+                    self._commit()
+                return
+        segment = self._segment_writer() if self.segmentsize else None
+        if segment is not None:
+            pageid = segment.new_pageid()
+        else:
+            pageid = self.new_pageid()
+        args = (idx, rec, self.pagedir, pageid, self.comp, segment)
+        if self._bulk is not None:
+            if self._bulk["executor"] is not None:
+                page = self._bulk["executor"].submit(Page.from_data, *args)
+            else:
+                page = Page.from_data(*args)
+            self._bulk["written"].append(page)
+            self._stage(variable, "insert", page)
+            return
+        page = Page.from_data(*args)
+        self._insert_page(variable, page)
         if commit:
-            self.db.commit()
+            self._commit()
+
+    def _insert_page(self, variable, page):
+        sql = """INSERT INTO pages VALUES
+             (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)"""
+        data = page._tolist()
+        stats = list(page.stats or [None] * len(STAT_FIELDS))
+        if isinstance(page, SegmentPage):
+            segment = [page.segment, format_parts(page.parts)]
+        else:
+            segment = [None, None]
+        self.db.execute(sql, [variable] + data + [None] + stats + segment)
+        sql = """UPDATE variables SET
+               idxa=MIN(idxa,?),idxb=MAX(idxb,?),count=count+?,
+               recsize=recsize+?,npages=npages+1,
+               idxtype=?,rectype=?,reclen=?
+               WHERE name==?"""
+        args = [data[3], data[4], data[2], data[7]]
+        args += [data[1], data[5], data[6], variable]
+        if self.db.execute(sql, args).rowcount == 0:
+            sql = """INSERT INTO variables VALUES (?,?,?,?,?,1,?,?,?)"""
+            args = [variable, data[3], data[4], data[2], data[7]]
+            args += [data[1], data[5], data[6]]
+            self.db.execute(sql, args)
+
+    def _remove_page(self, pageid):
+        # update variables for a page leaving the live set
+        cur = self.db.cursor()
+        sql = """SELECT name,count,idxa,idxb,recsize FROM pages
+               WHERE pageid==? AND deleted IS NULL"""
+        res = cur.execute(sql, [pageid]).fetchone()
+        if res is None:
+            return
+        variable, count, idxa, idxb, recsize = res
+        sql = """UPDATE variables SET count=count-?,recsize=recsize-?,
+               npages=npages-1 WHERE name==?"""
+        cur.execute(sql, [count, recsize, variable])
+        sql = """DELETE FROM variables WHERE name==? AND npages<=0"""
+        if cur.execute(sql, [variable]).rowcount > 0:
+            return
+        sql = """SELECT idxa,idxb FROM variables WHERE name==?"""
+        vidxa, vidxb = cur.execute(sql, [variable]).fetchone()
+        if idxa == vidxa:
+            sql = """UPDATE variables SET idxa=(
+                   SELECT MIN(idxa) FROM pages WHERE name==?
+                   AND deleted IS NULL AND pageid!=?) WHERE name==?"""
+            cur.execute(sql, [variable, pageid, variable])
+        if idxb == vidxb:
+            sql = """UPDATE variables SET idxb=(
+                   SELECT MAX(idxb) FROM pages WHERE name==?
+                   AND deleted IS NULL AND pageid!=?) WHERE name==?"""
+            cur.execute(sql, [variable, pageid, variable])
+
+    def page_select(self):
+        # columns of the page tuples, pagedata[:10] are Page arguments
+        cols = "pageid,idxtype,count,idxa,idxb,"
+        cols += "rectype,reclen,recsize,comp,checksum,"
+        if "segment" in self.page_columns():
+            return cols + "segment,segparts"
+        return cols + "NULL,NULL"
+
+    def _page(self, pagedata, check=False):
+        if len(pagedata) > 10 and pagedata[10] is not None:
+            return SegmentPage(
+                pagedata[10],
+                self.segment_path(pagedata[10]),
+                parse_parts(pagedata[11]),
+                self.pagedir,
+                *pagedata[:10],
+                check=check,
+                mmap=self.mmap
+            )
+        return Page(self.pagedir, *pagedata[:10], check=check, mmap=self.mmap)
 
     def get_pages(self, variable, idxa=None, idxb=None):
+        self._flush_staged(variable)
         cur = self.db.cursor()
         idxa, idxb = self.get_lim(variable, idxa, idxb)
-        sql = """SELECT pageid,idxtype,count,idxa,idxb,
-                      rectype,reclen,recsize,comp,checksum
-               FROM pages WHERE name==? AND idxb>=? AND idxa<=?
+        # pages of a variable do not overlap: seek the first page ending
+        # after idxa on (name,idxb), then range scan (name,idxa) to idxb
+        sql = "SELECT " + self._pagecols + """
+               FROM pages WHERE name==? AND idxa<=? AND idxb>=?
                AND deleted IS NULL
+               AND idxa>=(SELECT idxa FROM pages
+                          WHERE name==? AND idxb>=? AND deleted IS NULL
+                          ORDER BY idxb LIMIT 1)
                ORDER BY idxa"""
-        pages = list(cur.execute(sql, [variable, idxa, idxb]))
+        idxa, idxb = toscalar(idxa), toscalar(idxb)
+        args = [variable, idxb, idxa, variable, idxa]
+        pages = list(cur.execute(sql, args))
         return pages
 
-    def get(self, variables, idxa=None, idxb=None):
+    def get_last_page(self, variable):
+        # the pages inserted or updated in a bulk are used as staged, so
+        # that stores appending to a variable do not start the transaction
+        staged = {}
+        if self._bulk is not None:
+            ops = self._bulk["staged"].get(variable, [])
+            if any(op == "delete" for op, page in ops):
+                self._flush_staged(variable)
+                ops = []
+            for op, page in ops:
+                if isinstance(page, Future):
+                    page = page.result()
+                staged[page.pageid] = page
+        cur = self.db.cursor()
+        sql = "SELECT " + self._pagecols + """
+               FROM pages WHERE name==? AND deleted IS NULL
+               ORDER BY idxb DESC LIMIT 1"""
+        res = cur.execute(sql, [variable]).fetchone()
+        last = None
+        if res is not None and res[0] not in staged:
+            last = self._page(res)
+            last.stats = self._get_page_stats([last.pageid])[last.pageid]
+        for page in staged.values():
+            if last is None or page.idxb > last.idxb:
+                last = page
+        return last
+
+    def _get_page_stats(self, pageids):
+        # {pageid: stats or None} from the catalog
+        sql = "SELECT pageid,%s FROM pages WHERE pageid IN (%s)" % (
+            ",".join(STAT_FIELDS),
+            ",".join("?" * len(pageids)),
+        )
+        out = {}
+        for row in self.db.execute(sql, pageids):
+            # sum is NULL only for pages without statistics
+            out[row[0]] = None if row[3] is None else tuple(row[1:])
+        return out
+
+    def stats(self, variable, idxa=None, idxb=None):
+        """Return the Stat of the numeric scalar records of variable
+        between idxa and idxb, None for other variables.
+
+        Statistics of the pages within the range come from the catalog,
+        only the boundary pages are read.
+        """
+        idxa, idxb = self.get_lim(variable, idxa, idxb)
+        pages = self.get_pages(variable, idxa, idxb)
+        if len(pages) == 0:
+            return None
+        known = {}
+        if self.has_stats_columns():
+            known = self._get_page_stats([pagedata[0] for pagedata in pages])
+        parts = []
+        count = 0
+        tmin = tmax = None
+        for pagedata in pages:
+            pageid, pcount, pidxa, pidxb = [pagedata[k] for k in (0, 2, 3, 4)]
+            stats = known.get(pageid)
+            if stats is not None and idxa <= pidxa and pidxb <= idxb:
+                first, last = pidxa, pidxb
+            else:
+                if pagedata[6] != 0:
+                    return None
+                idx, rec = self._read_page(pagedata, idxa, idxb)
+                stats = page_stats(rec)
+                if stats is None:
+                    return None
+                if len(idx) == 0:
+                    continue
+                pcount = len(idx)
+                first, last = toscalar(idx[0]), toscalar(idx[-1])
+            parts.append(stats)
+            count += pcount
+            tmin = first if tmin is None else tmin
+            tmax = last
+        if len(parts) == 0:
+            return None
+        return to_stat(tmin, tmax, count, combine_stats(parts))
+
+    def get(
+        self, variables, idxa=None, idxb=None, resolution=None, maxpoints=None
+    ):
         data = {}
         if isstr(variables):
             varlist = self.search(variables)
         elif isinstance(variables, (list, tuple)):
             varlist = variables
+        if resolution is not None or maxpoints is not None:
+            for variable in varlist:
+                data[variable] = self.get_variable(
+                    variable, idxa, idxb, resolution, maxpoints
+                )
+            return data
+        if self.workers and self.cache is None:
+            # pages of all the variables are read by the same pool
+            lims = [self.get_lim(variable, idxa, idxb) for variable in varlist]
+            pages = [
+                self.get_pages(variable, *lim)
+                for variable, lim in zip(varlist, lims)
+            ]
+            out = self._read_parallel(pages, lims)
+            return dict(zip(varlist, out))
         for variable in varlist:
             data[variable] = self.get_variable(variable, idxa=idxa, idxb=idxb)
         return data
 
-    def get_variable(self, variable, idxa=None, idxb=None):
+    def get_variable(
+        self, variable, idxa=None, idxb=None, resolution=None, maxpoints=None
+    ):
+        """Return idx and records of variable between idxa and idxb.
+
+        With resolution or maxpoints the coarsest aggregate level with
+        buckets no larger than resolution, or the finest one within
+        maxpoints buckets, is returned instead of the samples if any:
+        idx are the bucket starts and the records have the columns in
+        pyramid.LEVEL_FIELDS.
+        """
         idxa, idxb = self.get_lim(variable, idxa, idxb)
+        if resolution is not None or maxpoints is not None:
+            bucket = self.get_level(
+                variable, idxa, idxb, resolution, maxpoints
+            )
+            if bucket is not None:
+                name = pyramid.level_name(variable, bucket)
+                idxa = np.floor(idxa / bucket) * bucket
+                return self.get_variable(name, idxa, idxb)
         pages = self.get_pages(variable, idxa, idxb)
+        if self.workers and self.cache is None and len(pages) > 1:
+            return self._read_parallel([pages], [(idxa, idxb)])[0]
         if len(pages) > 0:
-            page = Page(self.pagedir, *pages[0], check=True)
-            out = [page.get(idxa, idxb)]
+            out = [self._read_page(pages[0], idxa, idxb)]
             for res in pages[1:-1]:
-                page = Page(self.pagedir, *res, check=True)
-                out.append(page.get_all())
+                out.append(self._read_page(res))
             if len(pages) > 1:
-                page = Page(self.pagedir, *pages[-1], check=True)
-                out.append(page.get(idxa, idxb))
+                out.append(self._read_page(pages[-1], idxa, idxb))
             idx, rec = zip(*out)
             idx = concatenate(idx)
             rec = concatenate(rec)
@@ -213,91 +978,625 @@ class PageStore(object):
             rec = np.array([])
         return idx, rec
 
+    def iter_variable(self, variable, idxa=None, idxb=None, chunk_rows=None):
+        """Yield idx and records of variable between idxa and idxb in
+        chunks, one per page or of chunk_rows records, the last one
+        possibly shorter.
+
+        The next page, or slice of a page larger than chunk_rows, is read
+        in the background while a chunk is processed, so that only a few
+        chunks are held in memory whatever the range.
+        """
+        idxa, idxb = self.get_lim(variable, idxa, idxb)
+        if idxa is None:
+            return
+        pages = self.get_pages(variable, idxa, idxb)
+        executor = self._get_executor()
+
+        def reads():
+            # functions reading the successive pieces of the range
+            for pagedata in pages:
+                if chunk_rows is None or pagedata[2] <= chunk_rows:
+                    yield partial(self._read_page, pagedata, idxa, idxb)
+                    continue
+                page = self._page(pagedata, check=self.verify)
+                a, b = page.get_range(idxa, idxb)
+                for i in range(a, b, chunk_rows):
+                    yield partial(page.get_slice, i, min(i + chunk_rows, b))
+
+        def pieces():
+            pending = None
+            for read in reads():
+                fut = executor.submit(read)
+                if pending is not None:
+                    yield pending.result()
+                pending = fut
+            if pending is not None:
+                yield pending.result()
+
+        if chunk_rows is None:
+            for idx, rec in pieces():
+                if len(idx) > 0:
+                    yield idx, rec
+            return
+        idxbuf, recbuf, count = [], [], 0
+        for idx, rec in pieces():
+            while len(idx) > 0:
+                cut = min(chunk_rows - count, len(idx))
+                idxbuf.append(idx[:cut])
+                recbuf.append(rec[:cut])
+                count += cut
+                idx, rec = idx[cut:], rec[cut:]
+                if count == chunk_rows:
+                    yield concatenate(idxbuf), concatenate(recbuf)
+                    idxbuf, recbuf, count = [], [], 0
+        if count > 0:
+            yield concatenate(idxbuf), concatenate(recbuf)
+
+    def iter_variables(self, variables, step, idxa=None, idxb=None):
+        """Yield (start, {variable: (idx, rec)}) for the consecutive
+        windows [start, start+step) between idxa and idxb, windows without
+        data are skipped.
+
+        Each variable is streamed by iter_variable, so that about one page
+        per variable is held in memory whatever the range.
+        """
+        if isstr(variables):
+            varlist = self.search(variables)
+        else:
+            varlist = list(variables)
+        lims = [self.get_lim(variable, idxa, idxb) for variable in varlist]
+        lims = [lim for lim in lims if lim[0] is not None]
+        if len(lims) == 0:
+            return
+        if idxa is None:
+            idxa = min(lim[0] for lim in lims)
+        if idxb is None:
+            idxb = max(lim[1] for lim in lims)
+        streams = {vv: self.iter_variable(vv, idxa, idxb) for vv in varlist}
+        buffers = {vv: [] for vv in varlist}
+        start = idxa
+        while start <= idxb:
+            end = start + step
+            for variable in varlist:
+                buf = buffers[variable]
+                while variable in streams and (
+                    len(buf) == 0 or buf[-1][0][-1] < end
+                ):
+                    try:
+                        buf.append(next(streams[variable]))
+                    except StopIteration:
+                        del streams[variable]
+            heads = [buf[0][0][0] for buf in buffers.values() if buf]
+            if len(heads) == 0:
+                break
+            if min(heads) >= end:
+                start += np.floor((min(heads) - start) / step) * step
+                continue
+            data = {}
+            for variable in varlist:
+                idxlist, reclist, rest = [], [], []
+                for idx, rec in buffers[variable]:
+                    cut = idx.searchsorted(end)
+                    if cut > 0:
+                        idxlist.append(idx[:cut])
+                        reclist.append(rec[:cut])
+                    if cut < len(idx):
+                        rest.append((idx[cut:], rec[cut:]))
+                buffers[variable] = rest
+                if len(idxlist) > 0:
+                    data[variable] = concatenate(idxlist), concatenate(reclist)
+                else:
+                    data[variable] = np.array([]), np.array([])
+            yield start, data
+            start = end
+
+    def get_aligned(
+        self,
+        variables,
+        idxa=None,
+        idxb=None,
+        master=None,
+        method="previous",
+        tolerance=None,
+    ):
+        """Return the records of variables aligned to the idx of master,
+        by default the first variable, between idxa and idxb, as
+        {"timestamps": idx, variable: records} like LoggingDB.getAligned.
+
+        method is "previous", "next", "nearest" or "linear" and records
+        further than tolerance are not used, see align.align. Missing
+        values are NaN for numeric records, None otherwise.
+        """
+        if method not in METHODS:
+            raise ValueError("Unknown alignment method %r" % (method,))
+        if isstr(variables):
+            varlist = self.search(variables)
+        else:
+            varlist = list(variables)
+        if master is None:
+            master = varlist[0]
+        ts, rec = self.get_variable(master, idxa, idxb)
+        out = {"timestamps": ts, master: rec}
+        others = [variable for variable in varlist if variable != master]
+        if len(ts) == 0:
+            out.update((variable, np.array([])) for variable in others)
+            return out
+        lims = [
+            self._aligned_lim(variable, ts[0], ts[-1], method, tolerance)
+            for variable in others
+        ]
+        if self.workers and self.cache is None:
+            pages = [
+                self.get_pages(variable, *lim)
+                for variable, lim in zip(others, lims)
+            ]
+            data = self._read_parallel(pages, lims)
+        else:
+            data = [
+                self.get_variable(variable, *lim)
+                for variable, lim in zip(others, lims)
+            ]
+        for variable, (idx, rec) in zip(others, data):
+            out[variable] = align(ts, idx, rec, method, tolerance)
+        return out
+
+    def _aligned_lim(self, variable, idxa, idxb, method, tolerance):
+        # range of variable holding the samples aligned to idxa..idxb:
+        # within tolerance, else up to the page of the previous sample
+        # and the page of the next one
+        if method != "next":
+            if tolerance is not None:
+                idxa = idxa - tolerance
+            else:
+                sql = """SELECT MAX(idxa) FROM pages WHERE name==?
+                       AND idxa<=? AND deleted IS NULL"""
+                res = self.db.execute(sql, [variable, toscalar(idxa)])
+                first = res.fetchone()[0]
+                if first is not None:
+                    idxa = first
+        if method != "previous":
+            if tolerance is not None:
+                idxb = idxb + tolerance
+            else:
+                sql = """SELECT MIN(idxb) FROM pages WHERE name==?
+                       AND idxb>=? AND deleted IS NULL"""
+                res = self.db.execute(sql, [variable, toscalar(idxb)])
+                first = res.fetchone()[0]
+                if first is not None:
+                    idxb = first
+        return idxa, idxb
+
+    def get_level(self, variable, idxa, idxb, resolution=None, maxpoints=None):
+        # bucket of the level to read, None for the samples
+        levels = [
+            bucket
+            for bucket in self.levels
+            if self.count(pyramid.level_name(variable, bucket)) > 0
+        ]
+        if len(levels) == 0 or idxa is None:
+            return None
+        if resolution is not None:
+            levels = [bucket for bucket in levels if bucket <= resolution]
+            return levels[-1] if len(levels) > 0 else None
+        if self.count(variable, idxa, idxb) <= maxpoints:
+            return None
+        for bucket in levels:
+            if (idxb - idxa) / bucket <= maxpoints:
+                return bucket
+        return levels[-1]
+
+    def update_levels(self, variable, idxa=None, idxb=None):
+        """Recompute the aggregate levels of variable for the buckets
+        between idxa and idxb from the samples, each level from the one
+        below."""
+        if len(self.levels) == 0 or pyramid.is_level(variable):
+            return
+        self._flush_staged(variable)
+        idxa, idxb = self.get_lim(variable, idxa, idxb)
+        if idxa is None:
+            return
+        sql = """SELECT rectype,reclen FROM variables WHERE name==?"""
+        res = self.db.execute(sql, [variable]).fetchone()
+        if res is None or res[1] != 0:
+            return
+        if np.dtype(res[0]).kind not in "iufb":
+            return
+        source = variable
+        for k, bucket in enumerate(self.levels):
+            a = np.floor(idxa / bucket) * bucket
+            b = (np.floor(idxb / bucket) + 1) * bucket
+            idx, rec = self.get_variable(source, a, b)
+            keep = idx < b
+            if k == 0:
+                lidx, lrec = pyramid.aggregate(idx[keep], rec[keep], bucket)
+            else:
+                lidx, lrec = pyramid.combine(idx[keep], rec[keep], bucket)
+            source = pyramid.level_name(variable, bucket)
+            if len(lidx) > 0:
+                with self.lock(source):
+                    self._store_variable(source, lidx, lrec)
+
+    def find(self, variable, predicate, idxa=None, idxb=None, intervals=False):
+        """Return the idx of the records of variable between idxa and idxb
+        satisfying predicate, see stats.parse_predicate, or with
+        intervals=True the [first, last] idx of the runs of consecutive
+        matching records.
+
+        Pages whose min and max in the catalog exclude a match are not
+        read. Vector records match if any of their values does, empty
+        ragged records never.
+        """
+        test, may_match = parse_predicate(predicate)
+        idxa, idxb = self.get_lim(variable, idxa, idxb)
+        pages = self.get_pages(variable, idxa, idxb)
+        known = {}
+        if len(pages) > 0 and self.has_stats_columns():
+            known = self._get_page_stats([pagedata[0] for pagedata in pages])
+        found = []
+        runs = []
+        last = None  # position of the last page read if it ended matching
+        for k, pagedata in enumerate(pages):
+            stats = known.get(pagedata[0])
+            if stats is not None and not may_match(stats):
+                continue
+            idx, rec = self._read_page(pagedata, idxa, idxb)
+            if isinstance(rec, RaggedArray):
+                mask = np.asarray(test(rec.get_values()), dtype=bool)
+            else:
+                mask = np.asarray(test(rec), dtype=bool)
+            if mask.ndim > 1:
+                mask = mask.reshape(len(mask), -1).any(axis=1)
+            if isinstance(rec, RaggedArray):
+                # matching values before each record boundary
+                hits = np.r_[0, np.cumsum(mask)]
+                offsets = rec.offsets - rec.offsets[0]
+                mask = hits[offsets[1:]] > hits[offsets[:-1]]
+            if not intervals:
+                found.append(idx[mask])
+                continue
+            edges = np.diff(np.r_[0, mask.view("i1"), 0])
+            starts = np.flatnonzero(edges == 1)
+            ends = np.flatnonzero(edges == -1) - 1
+            for a, b in zip(starts, ends):
+                if a == 0 and last == k - 1:
+                    runs[-1][1] = idx[b]
+                else:
+                    runs.append([idx[a], idx[b]])
+            last = k if len(mask) > 0 and mask[-1] else None
+        if intervals:
+            return np.array(runs).reshape(-1, 2)
+        if len(found) == 0:
+            return np.array([])
+        return concatenate(found)
+
+    def _read_page(self, pagedata, idxa=None, idxb=None):
+        # records of the page between idxa and idxb, or all of them,
+        # decoded pages are kept in the cache if any
+        if self.cache is None:
+            page = self._page(pagedata, check=self.verify)
+            if idxa is None:
+                return page.get_all()
+            return page.get(idxa, idxb)
+        key = (pagedata[0], pagedata[9])
+        data = self.cache.get(key)
+        if data is None:
+            page = self._page(pagedata, check=self.verify)
+            data = self.cache.put(key, page.get_all())
+        if idxa is None:
+            return data
+        idx, rec = data
+        a = idx.searchsorted(idxa, side="left")
+        b = idx.searchsorted(idxb, side="right")
+        return idx[a:b], rec[a:b]
+
+    def _get_executor(self):
+        with self._mutex:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(self.workers)
+            return self._executor
+
+    def _read_parallel(self, pagelist, lims):
+        # read the pages of several variables concurrently: first the
+        # record ranges of the pages, then the records, directly into the
+        # output arrays when the records have a fixed length
+        executor = self._get_executor()
+
+        def locate(pages, k, idxa, idxb):
+            page = self._page(pages[k], check=self.verify)
+            if 0 < k < len(pages) - 1:
+                return page, 0, page.count
+            a, b = page.get_range(idxa, idxb)
+            return page, int(a), int(b)
+
+        def read(page, a, b):
+            return page.get_idx_all()[a:b], page.get_rec(a, b)
+
+        located = []
+        for pages, (idxa, idxb) in zip(pagelist, lims):
+            located.append(
+                [
+                    executor.submit(locate, pages, k, idxa, idxb)
+                    for k in range(len(pages))
+                ]
+            )
+        located = [[fut.result() for fut in futs] for futs in located]
+        result = []
+        tasks = []
+        for parts in located:
+            if len(parts) == 0:
+                result.append((np.array([]), np.array([])))
+                continue
+            pages = [page for page, a, b in parts]
+            first = pages[0]
+            fixed = all(
+                page.recsize > 0
+                and page.reclen == first.reclen >= 0
+                and page.rectype == first.rectype
+                for page in pages
+            )
+            if not fixed:
+                futs = [
+                    executor.submit(read, page, a, b) for page, a, b in parts
+                ]
+                result.append(futs)
+                continue
+            total = sum(b - a for page, a, b in parts)
+            idxtype = np.result_type(*[page.idxtype for page in pages])
+            idx = np.empty(total, dtype=idxtype)
+            if first.reclen == 0:
+                rec = np.empty(total, dtype=first.rectype)
+            else:
+                rec = np.empty((total, first.reclen), dtype=first.rectype)
+            pos = 0
+            for page, a, b in parts:
+                cc = b - a
+                tasks.append(
+                    executor.submit(
+                        page.get_into,
+                        a,
+                        b,
+                        idx[pos : pos + cc],
+                        rec[pos : pos + cc],
+                    )
+                )
+                pos += cc
+            result.append((idx, rec))
+        for fut in tasks:
+            fut.result()
+        for k, res in enumerate(result):
+            if isinstance(res, list):
+                idx, rec = zip(*[fut.result() for fut in res])
+                result[k] = concatenate(idx), concatenate(rec)
+        return result
+
     def get_idx(self, variable, idxa=None, idxb=None):
         idxa, idxb = self.get_lim(variable, idxa, idxb)
         pages = self.get_pages(variable, idxa, idxb)
-        page = Page(self.pagedir, *pages[0])
+        page = self._page(pages[0])
         out = [page.get_idx(idxa, idxb)]
         for res in pages[1:-1]:
-            page = Page(self.pagedir, *res)
+            page = self._page(res)
             out.append(page.get_idx_all())
         if len(pages) > 1:
-            page = Page(self.pagedir, *pages[-1])
+            page = self._page(pages[-1])
             out.append(page.get_idx(idxa, idxb))
         return concatenate(out)
 
     def count(self, variable, idxa=None, idxb=None):
+        if idxa is None and idxb is None:
+            self._flush_staged(variable)
+            sql = """SELECT count FROM variables WHERE name==?"""
+            res = self.db.execute(sql, [variable]).fetchone()
+            return 0 if res is None else res[0]
         idxa, idxb = self.get_lim(variable, idxa, idxb)
         pages = self.get_pages(variable, idxa, idxb)
         if len(pages) > 0:
-            page = Page(self.pagedir, *pages[0])
+            page = self._page(pages[0])
             tot = page.get_count(idxa, idxb)
             for res in pages[1:-1]:
                 tot += res[2]  # to change when using named_tupled
             if len(pages) > 1:
-                page = Page(self.pagedir, *pages[-1])
+                page = self._page(pages[-1])
                 tot += page.get_count(idxa, idxb)
             return tot
         else:
             return 0
 
     def get_page(self, pageid):
+        self._flush_staged()
         cur = self.db.cursor()
-        sql = """SELECT pageid,idxtype,count,idxa,idxb,
-                      rectype,reclen,recsize,comp,checksum
+        sql = "SELECT " + self._pagecols + """
                FROM pages WHERE pageid=?"""
         page = cur.execute(sql, [pageid]).fetchone()
-        return Page(self.pagedir, *page)
+        return self._page(page)
+
+    def _page_variable(self, pageid):
+        sql = "SELECT name FROM pages WHERE pageid==?"
+        return self.db.execute(sql, [pageid]).fetchone()[0]
 
     def delete_page(self, page):
+        if self._bulk is not None:
+            self._stage(self._page_variable(page.pageid), "delete", page)
+            return
+        tombstone = self._delete_page(page)
+        self.db.commit()
+        if tombstone:
+            self.reclaim()
+        else:
+            page.delete()
+
+    def _delete_page(self, page):
+        # return True if the page is only marked as deleted
         cur = self.db.cursor()
-        if self.keep_deleted_pages:
+        if self.cache is not None:
+            self.cache.invalidate(page.pageid)
+        self._remove_page(page.pageid)
+        # readers may have listed the page before the commit, its files
+        # are only removed after grace seconds by reclaim
+        tombstone = self.keep_deleted_pages or self.grace > 0
+        if tombstone:
             sql = """UPDATE pages SET deleted=strftime('%s','now')
                  WHERE pageid==?"""
         else:
             sql = """DELETE FROM pages WHERE pageid==?"""
             # print("Delete page %s"%page.pageid)
         cur.execute(sql, [page.pageid])
-        self.db.commit()
-        if self.keep_deleted_pages is False:
-            page.delete()
+        if not tombstone and self._bulk is not None:
+            # page files are needed until the transaction is committed
+            self._bulk["deleted"].append(page)
+        return tombstone
 
     def delete_variable(self, variable):
         for page in self.get_pages(variable):
-            page = Page(self.pagedir, *page)
+            page = self._page(page)
             self.delete_page(page)
+        if not pyramid.is_level(variable):
+            for bucket in self.levels:
+                self.delete_variable(pyramid.level_name(variable, bucket))
 
     def store(self, data):
-        for variable, (idx, rec) in data.items():
-            self.store_variable(variable, idx, rec)
+        self.bulk_store(data)
 
     def store_variable(self, variable, idx, rec):
+        if self.readonly:
+            raise ValueError("Cannot store into a read-only PageStore")
+        with self.lock(variable):
+            self._store_variable(variable, idx, rec)
+            if len(self.levels) > 0 and len(idx) > 0:
+                idxa, idxb = np.min(idx), np.max(idx)
+                if self._bulk is None:
+                    self.update_levels(variable, idxa, idxb)
+                    return
+                # levels read the samples, they are updated after commit
+                levels = self._bulk["levels"]
+                if variable in levels:
+                    idxa = min(idxa, levels[variable][0])
+                    idxb = max(idxb, levels[variable][1])
+                levels[variable] = (idxa, idxb)
+
+    def _store_variable(self, variable, idx, rec):
         count = len(idx)
         idx = np.array(idx)
         if count > 0:
             if len(rec) != count:
                 msg = "idx,rec length mismatch %d!=%d" % (len(idx), len(rec))
                 raise ValueError(msg)
-            idxa = idx[0]
-            idxb = idx[-1]
-            pages = self.get_pages(variable, idxa, idxb)
-            pages = [Page(self.pagedir, *res) for res in pages]
-            for page in pages:
-                if len(idx) > 0:
-                    # if idx[0]<page.idxa:
-                    #   cut=idx.searchsorted(page.idxa)
-                    #            #    self.merge_page(variable,page,idx[:cut],rec[:cut])
-                    #   self.store_page(variable,idx[:cut],rec[:cut])
-                    #   idx=idx[cut:];rec=rec[cut:]
-                    if idx[0] <= page.idxb:
-                        cut = idx.searchsorted(page.idxb, side="right")
-                        self.merge_page(variable, page, idx[:cut], rec[:cut])
-                        idx = idx[cut:]
-                        rec = rec[cut:]
+            last = self.get_last_page(variable)
+            if self.maxpagesize > 0 and (last is None or idx[0] > last.idxb):
+                # new pages cut when the tail page is full or cannot be
+                # appended to may need to be merged
+                if self.append_variable(variable, idx, rec, last):
+                    return
+            else:
+                self._insert_variable(variable, idx, rec)
+        if self.maxpagesize > 0 and self.compaction is not None:
+            if self._bulk is None:
+                if self.compactor is not None:
+                    self.compactor.notify(variable)
+                else:
+                    self.rebalance(variable, self.maxpagesize)
+            elif self._bulk["rebalance"] == "deferred":
+                self._bulk["touched"].add(variable)
+            elif self._bulk["rebalance"] == "immediate":
+                self.rebalance_variable(variable, self.maxpagesize)
+
+    def _insert_variable(self, variable, idx, rec):
+        # data overlapping the stored one is merged in the pages it overlaps
+        pages = self.get_pages(variable, idx[0], idx[-1])
+        pages = [self._page(res) for res in pages]
+        for page in pages:
             if len(idx) > 0:
-                self.store_page(variable, idx, rec)
-        if self.maxpagesize > 0:
-            self.rebalance(variable, self.maxpagesize)
+                # if idx[0]<page.idxa:
+                #   cut=idx.searchsorted(page.idxa)
+                #            #    self.merge_page(variable,page,idx[:cut],rec[:cut])
+                #   self.store_page(variable,idx[:cut],rec[:cut])
+                #   idx=idx[cut:];rec=rec[cut:]
+                if idx[0] <= page.idxb:
+                    cut = idx.searchsorted(page.idxb, side="right")
+                    self.merge_page(variable, page, idx[:cut], rec[:cut])
+                    idx = idx[cut:]
+                    rec = rec[cut:]
+        if len(idx) > 0:
+            self.store_page(variable, idx, rec)
+
+    def append_variable(self, variable, idx, rec, page=None):
+        """Append data newer than page, the last one of variable, to page
+        up to maxpagesize before new pages are cut.
+
+        Return True if all the data went to page.
+        """
+        prec, rectype, reclen, recsize = prepare_rec(rec)
+        if reclen == -1:
+            itemsize = prec.dtype.itemsize
+            size = (prec.offsets[1:] - prec.offsets[0]) * itemsize
+        else:
+            size = np.arange(1, len(idx) + 1) * (recsize // len(idx))
+        if page is not None and page.can_append(idx.dtype, rectype, reclen):
+            free = self.maxpagesize - page.recsize
+            cut = size.searchsorted(free, side="right")
+            if self.partition is not None:
+                end = partitions.next_boundary(self.partition, page.idxa)
+                cut = min(cut, idx.searchsorted(end))
+            if cut > 0:
+                # the page files are truncated back if the catalog is
+                # not updated
+                sizes = {pp: os.path.getsize(pp) for pp in page.get_files()}
+                if self._bulk is not None:
+                    self._bulk["appended"].append(sizes)
+                try:
+                    page.append(idx[:cut], prec[:cut])
+                    self.update_page(page, variable=variable)
+                except BaseException:
+                    if self._bulk is None:
+                        self.db.rollback()
+                        truncate(sizes)
+                    raise
+                idx = idx[cut:]
+                rec = rec[cut:]
+                size = size[cut:] - size[cut - 1]
+        if len(idx) == 0:
+            return True
+        while len(idx) > 0:
+            cut = max(size.searchsorted(self.maxpagesize, side="right"), 1)
+            if self.partition is not None:
+                end = partitions.next_boundary(self.partition, idx[0])
+                cut = min(cut, idx.searchsorted(end))
+            self.store_page(variable, idx[:cut], rec[:cut])
+            idx = idx[cut:]
+            rec = rec[cut:]
+            size = size[cut:] - size[cut - 1]
+        return False
+
+    def update_page(self, page, commit=True, variable=None):
+        if self._bulk is not None:
+            # pages staged in the bulk are not in the catalog yet
+            if variable is None:
+                variable = self._page_variable(page.pageid)
+            self._stage(variable, "update", page)
+            return
+        self._update_page(page)
+        if commit:
+            self.db.commit()
+
+    def _update_page(self, page):
+        if self.cache is not None:
+            self.cache.invalidate(page.pageid)
+        sql = """UPDATE pages SET count=?,idxb=?,recsize=?,created=?,checksum=?,
+               vmin=?,vmax=?,vsum=?,vsumsq=?,nnan=?
+               WHERE pageid==?"""
+        data = page._tolist()
+        stats = list(page.stats or [None] * len(STAT_FIELDS))
+        sql_old = """SELECT name,count,recsize FROM pages WHERE pageid==?"""
+        variable, count, recsize = self.db.execute(
+            sql_old, [page.pageid]
+        ).fetchone()
+        args = [data[2], data[4], data[7], data[9], data[10]]
+        self.db.execute(sql, args + stats + [page.pageid])
+        sql = """UPDATE variables SET count=count+?,recsize=recsize+?,
+               idxb=MAX(idxb,?) WHERE name==?"""
+        args = [data[2] - count, data[7] - recsize, data[4], variable]
+        self.db.execute(sql, args)
 
     def merge_page(self, variable, page, idx, rec):
         pidx, prec = page.get_all()
@@ -306,31 +1605,89 @@ class PageStore(object):
         self.delete_page(page)
 
     def search(self, searchexp="%"):
+        self._flush_staged()
         cur = self.db.cursor()
-        sql = """SELECT DISTINCT name FROM pages WHERE name LIKE ?"""
-        res = cur.execute(sql, [str(searchexp)]).fetchall()
+        sql = """SELECT name FROM variables WHERE name LIKE ?"""
+        if not pyramid.is_level(str(searchexp)):
+            sql += " AND name NOT LIKE '@%'"
+        res = cur.execute(sql + " ORDER BY name", [str(searchexp)]).fetchall()
         return [rr[0] for rr in res]
 
     def get_lim(self, variable, idxa=None, idxb=None):
-        cur = self.db.cursor()
-        if idxa is None:
-            sql = """SELECT MIN(idxa) FROM PAGES WHERE name==?"""
-            idxa = cur.execute(sql, [variable]).fetchone()[0]
-        if idxb is None:
-            sql = """SELECT MAX(idxb) FROM PAGES WHERE name==?"""
-            idxb = cur.execute(sql, [variable]).fetchone()[0]
+        if idxa is None or idxb is None:
+            cur = self.db.cursor()
+            sql = """SELECT idxa,idxb FROM variables WHERE name==?"""
+            res = cur.execute(sql, [variable]).fetchone() or (None, None)
+            if idxa is None:
+                idxa = res[0]
+            if idxb is None:
+                idxb = res[1]
         return idxa, idxb
 
+    def get_summary(self, searchexp="%"):
+        self._flush_staged()
+        cur = self.db.cursor()
+        sql = """SELECT name,idxa,idxb,count,recsize,npages,
+                      idxtype,rectype,reclen
+               FROM variables WHERE name LIKE ?"""
+        if not pyramid.is_level(str(searchexp)):
+            sql += " AND name NOT LIKE '@%'"
+        cur.execute(sql + " ORDER BY name", [str(searchexp)])
+        fields = [dd[0] for dd in cur.description]
+        return {row[0]: dict(zip(fields[1:], row[1:])) for row in cur}
+
+    def scrub(self, searchexp="%", background=False):
+        """Check all the pages of the variables matching searchexp against
+        their checksums, return the ids of the corrupted pages.
+
+        With background=True the check runs in a daemon thread, which is
+        returned, and failures are only logged.
+        """
+        if background:
+            thread = threading.Thread(
+                target=self.scrub, args=(searchexp,), daemon=True
+            )
+            thread.start()
+            return thread
+        bad = []
+        for variable in self.search(searchexp):
+            for pagedata in self.get_pages(variable):
+                page = self._page(pagedata)
+                if not page.verify("always"):
+                    log.error(
+                        "Corrupted page %s of %s" % (page.pageid, variable)
+                    )
+                    bad.append(page.pageid)
+        return bad
+
     def rebalance(self, variables, maxpagesize):
         for variable in self.search(variables):
             self.rebalance_variable(variable, maxpagesize)
 
-    def rebalance_variable(self, variable, maxpagesize):
-        print("Rebalance %s" % variable)
+    def rebalance_variable(self, variable, maxpagesize, window=None):
+        """Merge runs of pages smaller than maxpagesize/2, with window
+        only pages starting in the same window of window idx units.
+
+        Pages in different partitions are never merged.
+        """
+        log.info("Rebalance %s" % variable)
+
+        def group(page):
+            key = (None if window is None else page.idxa // window,)
+            if self.partition is not None:
+                key += (partitions.keys(self.partition, page.idxa),)
+            return key
+
         acc = 0
         tomerge = []
         for pagedata in self.get_pages(variable):
-            page = Page(self.pagedir, *pagedata)
+            page = self._page(pagedata)
+            if len(tomerge) > 0:
+                if group(page) != group(tomerge[0]):
+                    if len(tomerge) > 1:
+                        self.merge_pages(variable, tomerge)
+                    acc = 0
+                    tomerge = []
             if acc != 0 or page.recsize < maxpagesize / 2:
                 acc += page.recsize
                 tomerge.append(page)
@@ -342,58 +1699,315 @@ class PageStore(object):
             self.merge_pages(variable, tomerge)
         return self
 
+    def compact_variable(self, variable, window=None):
+        """Rebalance variable in a single transaction under the variable
+        lock, return the number of pages before and after."""
+        with self.lock(variable), self.bulk(rebalance=None):
+            before = len(self.get_pages(variable))
+            if self.maxpagesize > 0:
+                self.rebalance_variable(variable, self.maxpagesize, window)
+            after = len(self.get_pages(variable))
+        return before, after
+
     def get_info(self, variable=None):
+        self._flush_staged()
         cur = self.db.cursor()
-        suf = "FROM pages"
+        sql = "SELECT COUNT(*),SUM(npages),SUM(count),SUM(recsize) "
+        sql += "FROM variables"
         if variable is not None:
-            suf += ' WHERE name=="%s"' % variable
+            sql += " WHERE name==?"
+            res = cur.execute(sql, [variable]).fetchone()
             out = ""
         else:
-            nvars = cur.execute(
-                "SELECT COUNT(DISTINCT name) FROM pages"
-            ).fetchone()[0]
-            out = "%s variables, " % (human_readable(nvars))
-        npages = cur.execute("SELECT COUNT(*)" + suf).fetchone()[0]
-        nrecords = cur.execute("SELECT SUM(count)" + suf).fetchone()[0]
-        nsize = cur.execute("SELECT SUM(recsize)" + suf).fetchone()[0]
-        asize = cur.execute("SELECT AVG(recsize)" + suf).fetchone()[0]
-        if npages > 0:
+            res = cur.execute(sql + " WHERE name NOT LIKE '@%'").fetchone()
+            out = "%s variables, " % (human_readable(res[0]))
+        nvars, npages, nrecords, nsize = res
+        if npages:
+            asize = nsize / npages
             data = tuple(map(human_readable, (npages, nrecords, nsize, asize)))
             out += "%s pages, %s records, %sB total, %sB/page" % data
         return out
 
-    def merge_pages(self, variable, pages):
-        print("Merging %d pages" % len(pages))
-        out = [page.get_all() for page in pages]
-        idxlist, reclist = zip(*out)
-        self.store_page(variable, concatenate(idxlist), concatenate(reclist))
-        for page in pages:
-            self.delete_page(page)
+    def merge_pages(self, variable, pages, maxsize=None):
+        # one transaction so that readers never see both the merged page
+        # and its sources
+        log.info("Merging %d pages" % len(pages))
+        if maxsize is None:
+            maxsize = self.maxpagesize
+        with self.bulk(rebalance=None):
+            self.rewrite_pages(variable, pages, maxsize)
+            for page in pages:
+                self.delete_page(page)
 
     def split_pages(self, variable, maxsize):
         for pagedata in self.get_pages(variable):
-            page = Page(self.pagedir, *pagedata)
+            page = self._page(pagedata)
             if page.recsize > maxsize:
-                chunks = int(page.recsize / maxsize)
-                step = int(page.count / chunks)
-                print("Splitting in %d pages" % chunks)
-                for i in range(0, page.count, step):
-                    idx, rec = page.get_all()
+                log.info("Splitting page %d" % page.pageid)
+                with self.bulk(rebalance=None):
+                    self.rewrite_pages(variable, [page], maxsize)
+                    self.delete_page(page)
+
+    def rewrite_pages(self, variable, pages, maxsize):
+        """Store the records of pages in new pages of about the same size,
+        at most maxsize bytes unless 0.
+
+        Each source page is read once, in slices, so that no more than
+        about maxsize bytes of records are held in memory.
+        """
+        total = sum(page.recsize for page in pages)
+        nout = max(int(np.ceil(total / maxsize)), 1) if maxsize > 0 else 1
+        limit = maxsize if maxsize > 0 else np.inf
+        target = total / nout if nout > 1 else limit
+        idxbuf, recbuf, acc = [], [], 0
+        for page in pages:
+            pos = page.get_rec_bytes()
+            a = 0
+            while a < page.count:
+                # records filling the current output page, at least one
+                b = pos.searchsorted(pos[a] + target - acc, side="right") - 1
+                b = min(max(b, a + 1), page.count)
+                idx, rec = page.get_slice(a, b)
+                idxbuf.append(idx)
+                recbuf.append(rec)
+                acc += pos[b] - pos[a]
+                a = b
+                if b < page.count or acc >= target:
                     self.store_page(
-                        variable, idx[i : i + step], rec[i : i + step]
+                        variable, concatenate(idxbuf), concatenate(recbuf)
                     )
-                self.delete_page(page)
+                    idxbuf, recbuf, acc = [], [], 0
+                    nout -= 1
+                    if nout <= 1:
+                        # the last page takes the rounding leftovers
+                        target = limit
+        if len(idxbuf) > 0:
+            self.store_page(variable, concatenate(idxbuf), concatenate(recbuf))
 
-    def prune_delete_pages(self, timestamp=None):
-        cur = self.db.cursor()
+    def drop_partitions(self, before, searchexp="%"):
+        """Delete the data of the variables matching searchexp, and of
+        their aggregate levels, in the partitions ending before before,
+        return the number of pages deleted.
+
+        Only whole pages are deleted, without partitioning those ending
+        before before.
+        """
+        if self.partition is not None:
+            before = partitions.start(self.partition, before)
+        names = self.search(searchexp)
+        if not pyramid.is_level(str(searchexp)):
+            names += [
+                pyramid.level_name(variable, bucket)
+                for variable in names
+                for bucket in self.levels
+            ]
+        sql = "SELECT " + self._pagecols + """
+               FROM pages WHERE name==? AND idxb<? AND deleted IS NULL"""
+        ndeleted = 0
+        with self.bulk(rebalance=None):
+            for name in names:
+                with self.lock(name):
+                    pages = list(self.db.execute(sql, [name, before]))
+                    for pagedata in pages:
+                        self.delete_page(self._page(pagedata))
+                    ndeleted += len(pages)
+        log.info("Dropped %d pages before %s" % (ndeleted, before))
+        return ndeleted
+
+    def prune_delete_pages(self, timestamp=None, workers=None, grace=0):
+        """Remove the pages deleted grace seconds before timestamp (default
+        now), return the bytes freed per variable.
+
+        The catalog rows go in one transaction, the files are unlinked
+        afterwards by workers threads.
+        """
         if timestamp is None:
             timestamp = "now"
-        sql = """SELECT pageid,idxtype,count,idxa,idxb,
-                      rectype,reclen,recsize,comp,checksum
-               FROM pages WHERE
-               deleted < strftime('%s',?)
-               """
-        pages = list(cur.execute(sql, [timestamp]))
-        for pagedata in pages:
-            page = Page(self.pagedir, *pagedata)
-            self.delete_page(page)
+        sql = "SELECT strftime('%s',?,?)"
+        modifier = "-%d seconds" % grace
+        cutoff = self.db.execute(sql, [timestamp, modifier]).fetchone()[0]
+        sql = "SELECT name," + self._pagecols + """
+               FROM pages WHERE deleted < ?"""
+        rows = list(self.db.execute(sql, [cutoff]))
+        if len(rows) == 0:
+            return {}
+        freed = {}
+        pages = []
+        for row in rows:
+            page = self._page(row[1:])
+            freed[row[0]] = freed.get(row[0], 0) + self._page_bytes(page)
+            pages.append(page)
+        self.db.execute("DELETE FROM pages WHERE deleted < ?", [cutoff])
+        self.db.commit()
+        with ThreadPoolExecutor(workers) as executor:
+            list(executor.map(lambda page: page.delete(), pages))
+        return freed
+
+    def reclaim(self):
+        """Remove the pages deleted more than grace seconds ago, unless
+        keep_deleted_pages is set."""
+        if self.keep_deleted_pages or self.readonly or self._bulk is not None:
+            return {}
+        return self.prune_delete_pages(grace=self.grace)
+
+    def _page_bytes(self, page):
+        # bytes used on disk by page
+        if isinstance(page, SegmentPage):
+            return sum(size for offset, size in page.parts.values())
+        return sum(
+            os.path.getsize(path)
+            for path in page.get_files()
+            if os.path.exists(path)
+        )
+
+    def find_missing(self):
+        """Return the ids of the live pages with missing files."""
+        sql = "SELECT " + self._pagecols + " FROM pages WHERE deleted IS NULL"
+        missing = []
+        for pagedata in list(self.db.execute(sql)):
+            page = self._page(pagedata)
+            if isinstance(page, SegmentPage):
+                ok = os.path.exists(page.segpath)
+            else:
+                ok = all(os.path.exists(path) for path in page.get_files())
+            if not ok:
+                missing.append(page.pageid)
+        return missing
+
+    def find_orphans(self, grace=3600):
+        """Return the page files in pagedir unknown to the catalog.
+
+        Files younger than grace seconds are skipped since they may belong
+        to a page being written.
+        """
+        known = set(
+            pageid for pageid, in self.db.execute("SELECT pageid FROM pages")
+        )
+        limit = time.time() - grace
+        orphans = []
+        for dirpath, dirnames, filenames in os.walk(self.pagedir):
+            if dirpath == self.pagedir and "segments" in dirnames:
+                dirnames.remove("segments")
+            for name in filenames:
+                base = name.split(".", 1)[0]
+                path = os.path.join(dirpath, name)
+                rel = os.path.relpath(
+                    os.path.join(dirpath, base), self.pagedir
+                )
+                pageid = path_to_id(rel)
+                if pageid is None or pageid in known:
+                    continue
+                if os.path.getmtime(path) < limit:
+                    orphans.append(path)
+        return sorted(orphans)
+
+    def _remove_empty_dirs(self, grace=3600):
+        # shard directories left empty, except those just created by
+        # claim_pageid for a page about to be written
+        limit = time.time() - grace
+        removed = 0
+        for dirpath, dirnames, filenames in os.walk(
+            self.pagedir, topdown=False
+        ):
+            if dirpath == self.pagedir or dirpath.startswith(self.segdir):
+                continue
+            try:
+                if os.path.getmtime(dirpath) < limit:
+                    os.rmdir(dirpath)
+                    removed += 1
+            except OSError:
+                pass
+        return removed
+
+    def vacuum(self, dryrun=False, grace=3600, workers=None, threshold=0.5):
+        """Reclaim the disk space of deleted pages, orphan page files,
+        empty shard directories, sparse segments and the catalog.
+
+        Return a report with the bytes reclaimable per variable, the
+        orphan files, the ids of the pages with missing files and, unless
+        dryrun, what was removed. Nothing is changed with dryrun=True.
+        """
+        if self._bulk is not None:
+            raise ValueError("Cannot vacuum inside bulk")
+        report = {"variables": {}, "orphans": self.find_orphans(grace)}
+        report["orphan_bytes"] = sum(
+            os.path.getsize(path) for path in report["orphans"]
+        )
+        report["missing"] = self.find_missing()
+        sql = "SELECT name," + self._pagecols + """
+               FROM pages WHERE deleted < strftime('%s','now',?)"""
+        modifier = "-%d seconds" % self.grace
+        for row in self.db.execute(sql, [modifier]):
+            size = self._page_bytes(self._page(row[1:]))
+            report["variables"][row[0]] = (
+                report["variables"].get(row[0], 0) + size
+            )
+        if dryrun:
+            return report
+        self.prune_delete_pages(workers=workers, grace=self.grace)
+        with ThreadPoolExecutor(workers) as executor:
+            list(executor.map(os.unlink, report["orphans"]))
+        report["segments"] = self.compact_segments(threshold)
+        report["dirs"] = self._remove_empty_dirs(grace)
+        self.db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        self.db.execute("VACUUM")
+        log.info(format_vacuum_report(report))
+        return report
+
+
+def format_vacuum_report(report):
+    out = []
+    for variable, size in sorted(report["variables"].items()):
+        out.append(
+            "%s: %sB in deleted pages" % (variable, human_readable(size))
+        )
+    if report["orphans"]:
+        out.append(
+            "%d orphan files: %sB"
+            % (len(report["orphans"]), human_readable(report["orphan_bytes"]))
+        )
+    if report["missing"]:
+        out.append(
+            "%d pages with missing files: %s"
+            % (len(report["missing"]), ",".join(map(str, report["missing"])))
+        )
+    if "segments" in report:
+        out.append(
+            "%sB reclaimed from segments" % human_readable(report["segments"])
+        )
+        out.append("%d empty directories removed" % report["dirs"])
+    return "\n".join(out)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m pytimber.pagestore",
+        description="Maintenance of a PageStore",
+    )
+    parser.add_argument("command", choices=["vacuum", "info"])
+    parser.add_argument("dbname")
+    parser.add_argument("pagedir")
+    parser.add_argument(
+        "--dry-run", action="store_true", help="only report, do not delete"
+    )
+    parser.add_argument(
+        "--grace",
+        type=float,
+        default=3600,
+        help="age in seconds of the files that can be orphans",
+    )
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args(argv)
+    db = PageStore(args.dbname, args.pagedir, compaction=None)
+    try:
+        if args.command == "info":
+            print(db.get_info())
+        else:
+            report = db.vacuum(args.dry_run, args.grace, args.workers)
+            print(format_vacuum_report(report))
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+import numpy as np
+
+# partitions are ("every", width) for windows of width idx units from 0,
+# or ("at", boundaries) for the intervals between sorted boundaries
+WIDTHS = {"hour": 3600, "day": 86400}
+
+
+def parse_partition(partition):
+    """Return the partition spec of partition.
+
+    partition is None, "hour" or "day" (UTC, for idx in seconds), a
+    window width in idx units, a sequence of boundaries such as fill start
+    times, or a string made by format_partition.
+    """
+    if partition is None or partition == "":
+        return None
+    if isinstance(partition, str):
+        if partition in WIDTHS:
+            return ("every", float(WIDTHS[partition]))
+        kind, _, value = partition.partition(":")
+        if kind == "every":
+            return ("every", float(value))
+        elif kind == "at":
+            return ("at", np.array(sorted(map(float, value.split(",")))))
+        raise ValueError("Unknown partition %r" % partition)
+    if np.isscalar(partition):
+        if partition <= 0:
+            raise ValueError("Partition width must be positive")
+        return ("every", float(partition))
+    return ("at", np.array(sorted(float(bb) for bb in partition)))
+
+
+def format_partition(spec):
+    # string saved in the catalog
+    if spec is None:
+        return ""
+    if spec[0] == "every":
+        return "every:%r" % spec[1]
+    return "at:" + ",".join("%r" % bb for bb in spec[1])
+
+
+def keys(spec, idx):
+    # partition number of each idx
+    if spec[0] == "every":
+        return np.floor(np.asarray(idx, dtype=float) / spec[1])
+    return spec[1].searchsorted(idx, side="right")
+
+
+def slices(spec, idx):
+    """Return the (start, stop) of the runs of sorted idx in the same
+    partition."""
+    kk = keys(spec, idx)
+    starts = np.flatnonzero(np.r_[True, kk[1:] != kk[:-1]])
+    stops = np.r_[starts[1:], len(kk)]
+    return list(zip(starts.tolist(), stops.tolist()))
+
+
+def start(spec, x):
+    # first idx of the partition of x
+    if spec[0] == "every":
+        return np.floor(x / spec[1]) * spec[1]
+    k = spec[1].searchsorted(x, side="right")
+    return spec[1][k - 1] if k > 0 else -np.inf
+
+
+def next_boundary(spec, x):
+    # first idx of the partition after the one of x
+    if spec[0] == "every":
+        return (np.floor(x / spec[1]) + 1) * spec[1]
+    k = spec[1].searchsorted(x, side="right")
+    return spec[1][k] if k < len(spec[1]) else np.inf
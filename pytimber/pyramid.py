@@ -0,0 +1,86 @@
+import numpy as np
+
+# columns of the records of an aggregate level
+LEVEL_FIELDS = ("min", "max", "mean", "count", "first", "last")
+
+
+def level_name(variable, bucket):
+    # levels are stored as hidden variables of the same store
+    return "@%g:%s" % (bucket, variable)
+
+
+def is_level(variable):
+    return variable.startswith("@")
+
+
+def parse_levels(levels):
+    # "1,60,3600" or a sequence of bucket sizes -> sorted list of floats
+    if levels is None or levels == "":
+        return []
+    if isinstance(levels, str):
+        levels = levels.split(",")
+    levels = sorted(float(bucket) for bucket in levels)
+    # each level is combined from whole buckets of the one below
+    for prev, bucket in zip(levels, levels[1:]):
+        ratio = bucket / prev
+        if prev <= 0 or abs(ratio - round(ratio)) > 1e-9:
+            msg = "Level %g is not a multiple of level %g" % (bucket, prev)
+            raise ValueError(msg)
+    return levels
+
+
+def _groups(idx, bucket):
+    # bucket start and first position of each bucket in sorted idx
+    keys = np.floor(np.asarray(idx) / bucket)
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    return keys[starts] * bucket, starts
+
+
+def _mean(total, count):
+    # NaN for the buckets without values
+    out = np.full(len(count), np.nan)
+    return np.divide(total, count, out=out, where=count > 0)
+
+
+def aggregate(idx, val, bucket):
+    """Aggregate the samples val at idx in buckets of size bucket.
+
+    Return the bucket starts and a (n, 6) array with the LEVEL_FIELDS.
+    NaN samples are left out of min, max, mean and count, as in
+    PageStore.stats.
+    """
+    val = np.asarray(val, dtype=float)
+    if len(idx) == 0:
+        return np.array([]), np.zeros((0, len(LEVEL_FIELDS)))
+    bidx, starts = _groups(idx, bucket)
+    ends = np.r_[starts[1:], len(val)]
+    nan = np.isnan(val)
+    count = np.add.reduceat(~nan, starts)
+    rec = np.empty((len(starts), len(LEVEL_FIELDS)))
+    rec[:, 0] = np.fmin.reduceat(val, starts)
+    rec[:, 1] = np.fmax.reduceat(val, starts)
+    rec[:, 2] = _mean(np.add.reduceat(np.where(nan, 0, val), starts), count)
+    rec[:, 3] = count
+    rec[:, 4] = val[starts]
+    rec[:, 5] = val[ends - 1]
+    return bidx, rec
+
+
+def combine(idx, rec, bucket):
+    """Aggregate the records of a finer level in buckets of size bucket."""
+    rec = np.asarray(rec, dtype=float)
+    if len(idx) == 0:
+        return np.array([]), np.zeros((0, len(LEVEL_FIELDS)))
+    bidx, starts = _groups(idx, bucket)
+    ends = np.r_[starts[1:], len(rec)]
+    count = np.add.reduceat(rec[:, 3], starts)
+    # buckets without values have a NaN mean and count 0
+    total = np.where(rec[:, 3] > 0, rec[:, 2] * rec[:, 3], 0)
+    out = np.empty((len(starts), len(LEVEL_FIELDS)))
+    out[:, 0] = np.fmin.reduceat(rec[:, 0], starts)
+    out[:, 1] = np.fmax.reduceat(rec[:, 1], starts)
+    out[:, 2] = _mean(np.add.reduceat(total, starts), count)
+    out[:, 3] = count
+    out[:, 4] = rec[starts, 4]
+    out[:, 5] = rec[ends - 1, 5]
+    return bidx, out
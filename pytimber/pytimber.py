@@ -42,6 +42,7 @@ import logging
 from .check_kerberos import check_kerberos
 from .sparkresources import SparkResources
 from .check_version import check_nxcals_version
+from .ragged import asvector
 
 try:
     import jpype
@@ -53,20 +54,8 @@ except ImportError:
         available!"""
     )
 import numpy as np
-from collections import namedtuple
-
-Stat = namedtuple(
-    "Stat",
-    [
-        "MinTstamp",
-        "MaxTstamp",
-        "ValueCount",
-        "MinValue",
-        "MaxValue",
-        "AvgValue",
-        "StandardDeviationValue",
-    ],
-)
+
+from .stats import Stat
 
 
 def _Timestamp2float(ts):
@@ -372,10 +361,10 @@ class LoggingDB(object):
                         )
             elif datatype == "VECTORNUMERIC":
                 try:
-                    ds = np.array([d.getDoubleValues() for d in ds])
+                    ds = asvector([d.getDoubleValues() for d in ds])
                 except jpype.java.lang.NoSuchMethodException:
                     try:
-                        ds = np.array([d.getLongValues() for d in ds])
+                        ds = asvector([d.getLongValues() for d in ds])
                     except jpype.java.lang.NoSuchMethodException:
                         self._log.warning(
                             "unsupported datatype, returning the java object"
@@ -389,7 +378,7 @@ class LoggingDB(object):
                     )
             elif datatype == "VECTORSTRING":
                 try:
-                    ds = np.array([d.getStringValues() for d in ds])
+                    ds = asvector([d.getStringValues() for d in ds])
                 except jpype.java.lang.NoSuchMethodException:
                     self._log.warning(
                         "unsupported datatype, returning the java object"
@@ -439,14 +428,14 @@ class LoggingDB(object):
                 data = [t for t in dataset]
         elif datatype == "VECTORNUMERIC":
             if dataclass == spi.VectorNumericDoubleData:
-                data = np.array(
+                data = asvector(
                     [
                         np.array(a[:], dtype=float)
                         for a in PrimitiveDataSets.doubleVectorData(dataset)
                     ]
                 )
             elif dataclass == spi.VectorNumericLongData:
-                data = np.array(
+                data = asvector(
                     [
                         np.array(a[:], dtype=int)
                         for a in PrimitiveDataSets.longVectorData(dataset)
@@ -458,7 +447,7 @@ class LoggingDB(object):
                 )
                 data = [t for t in dataset]
         elif datatype == "VECTORSTRING":
-            data = np.array(
+            data = asvector(
                 [
                     np.array(a[:], dtype="U")
                     for a in PrimitiveDataSets.stringVectorData(dataset)
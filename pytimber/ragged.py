@@ -0,0 +1,170 @@
+import numpy as np
+
+
+def _default_fill(dtype):
+    if dtype.kind in "fc":
+        return np.nan
+    elif dtype.kind in "SU":
+        return ""
+    else:
+        return 0
+
+
+class RaggedArray(object):
+    """Sequence of variable length records stored as one flat array.
+
+    Record i is values[offsets[i]:offsets[i+1]], offsets has len(self)+1
+    entries and does not need to start at zero, so that slices share
+    values and offsets with the parent.
+    """
+
+    def __init__(self, values, offsets):
+        self.values = np.asarray(values)
+        self.offsets = np.asarray(offsets, dtype="<i8")
+        if self.offsets.ndim != 1 or len(self.offsets) == 0:
+            raise ValueError("RaggedArray offsets must have at least 1 item")
+
+    @classmethod
+    def from_list(cls, rec, dtype=None):
+        if isinstance(rec, RaggedArray):
+            return rec
+        if isinstance(rec, np.ndarray) and rec.ndim == 2:
+            offsets = np.arange(len(rec) + 1, dtype="<i8") * rec.shape[1]
+            return cls(rec.ravel(), offsets)
+        rec = [np.asarray(rrr, dtype=dtype).ravel() for rrr in rec]
+        offsets = np.zeros(len(rec) + 1, dtype="<i8")
+        np.cumsum([len(rrr) for rrr in rec], out=offsets[1:])
+        # empty records carry no values but might have a default dtype
+        nonempty = [rrr for rrr in rec if len(rrr) > 0]
+        if len(nonempty) > 0:
+            values = np.concatenate(nonempty)
+        else:
+            values = np.array([], dtype=dtype)
+        return cls(values, offsets)
+
+    @classmethod
+    def from_lengths(cls, values, lengths):
+        offsets = np.zeros(len(lengths) + 1, dtype="<i8")
+        np.cumsum(lengths, out=offsets[1:])
+        return cls(values, offsets)
+
+    @staticmethod
+    def concatenate(val):
+        val = [RaggedArray.from_list(vv) for vv in val]
+        if len(val) == 0:
+            return RaggedArray([], [0])
+        values = np.concatenate([vv.get_values() for vv in val])
+        lengths = np.concatenate([vv.lengths for vv in val])
+        return RaggedArray.from_lengths(values, lengths)
+
+    @property
+    def lengths(self):
+        return np.diff(self.offsets)
+
+    @property
+    def dtype(self):
+        return self.values.dtype
+
+    @property
+    def shape(self):
+        return (len(self),)
+
+    @property
+    def ndim(self):
+        return 1
+
+    @property
+    def nbytes(self):
+        return self.values.nbytes + self.offsets.nbytes
+
+    def get_values(self):
+        # values of the records in this array only
+        return self.values[self.offsets[0] : self.offsets[-1]]
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __iter__(self):
+        for a, b in zip(self.offsets[:-1], self.offsets[1:]):
+            yield self.values[a:b]
+
+    def __getitem__(self, item):
+        if isinstance(item, (int, np.integer)):
+            if item < 0:
+                item += len(self)
+            if item < 0 or item >= len(self):
+                raise IndexError("RaggedArray index out of range")
+            return self.values[self.offsets[item] : self.offsets[item + 1]]
+        elif isinstance(item, slice):
+            start, stop, step = item.indices(len(self))
+            if step == 1:
+                stop = max(start, stop)
+                return RaggedArray(self.values, self.offsets[start : stop + 1])
+        return self.take(np.arange(len(self))[item])
+
+    def take(self, indices):
+        indices = np.asarray(indices, dtype=int)
+        starts = self.offsets[:-1][indices]
+        lengths = self.offsets[1:][indices] - starts
+        offsets = np.zeros(len(indices) + 1, dtype="<i8")
+        np.cumsum(lengths, out=offsets[1:])
+        pos = np.repeat(starts - offsets[:-1], lengths)
+        pos += np.arange(offsets[-1])
+        return RaggedArray(self.values[pos], offsets)
+
+    def to_list(self):
+        return [rrr.tolist() for rrr in self]
+
+    def to_padded(self, fill=None, width=None):
+        lengths = self.lengths
+        if width is None:
+            width = lengths.max(initial=0)
+        if fill is None:
+            fill = _default_fill(self.dtype)
+        out = np.full((len(self), width), fill, dtype=self.dtype)
+        row = np.repeat(np.arange(len(self)), lengths)
+        col = np.arange(len(row)) - np.repeat(self.offsets[:-1], lengths)
+        col += self.offsets[0]
+        keep = col < width
+        out[row[keep], col[keep]] = self.get_values()[keep]
+        return out
+
+    def __repr__(self):
+        return "RaggedArray(%d records, %d %s values)" % (
+            len(self),
+            self.offsets[-1] - self.offsets[0],
+            self.dtype,
+        )
+
+
+def concatenate(val):
+    if any(isinstance(vv, RaggedArray) for vv in val):
+        return RaggedArray.concatenate(val)
+    if len(val) == 1:
+        return val[0]
+    try:
+        return np.concatenate(val)
+    except ValueError:
+        if all(isinstance(vv, np.ndarray) for vv in val):
+            return RaggedArray.concatenate(val)
+        out = []
+        for vv in val:
+            out.extend(vv)
+        return out
+
+
+def take(rec, indices):
+    if isinstance(rec, RaggedArray):
+        return rec.take(indices)
+    elif isinstance(rec, np.ndarray):
+        return rec[indices]
+    else:
+        return [rec[ii] for ii in indices]
+
+
+def asvector(rec, dtype=None):
+    # 2D array when all records have the same length, RaggedArray otherwise
+    rec = [np.asarray(rrr, dtype=dtype) for rrr in rec]
+    if len(set(len(rrr) for rrr in rec)) > 1:
+        return RaggedArray.from_list(rec, dtype=dtype)
+    return np.array(rec, dtype=dtype)
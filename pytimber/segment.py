@@ -0,0 +1,194 @@
+import os
+import threading
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from .page import Page
+from .pagecodec import read_bytes
+
+# segment files written by this process, never compacted by it
+_active = set()
+
+
+def segment_path(segdir, segid):
+    return os.path.join(segdir, "%08d.seg" % segid)
+
+
+def list_segments(segdir):
+    # {segid: path} of the segment files in segdir
+    if not os.path.isdir(segdir):
+        return {}
+    return {
+        int(name[:-4]): os.path.join(segdir, name)
+        for name in os.listdir(segdir)
+        if name.endswith(".seg")
+    }
+
+
+def claim_segment(segdir, minid=1):
+    # create a new segment file exclusively, return its id
+    segid = max([minid - 1] + list(list_segments(segdir))) + 1
+    while True:
+        try:
+            flags = os.O_CREAT | os.O_EXCL | os.O_WRONLY
+            os.close(os.open(segment_path(segdir, segid), flags))
+            return segid
+        except FileExistsError:
+            segid += 1
+
+
+def format_parts(parts):
+    # {suffix: (offset, size)} <-> "suffix:offset:size,..."
+    return ",".join(
+        "%s:%d:%d" % (kk, oo, ss) for kk, (oo, ss) in parts.items()
+    )
+
+
+def parse_parts(segparts):
+    parts = {}
+    for part in segparts.split(","):
+        suffix, offset, size = part.rsplit(":", 2)
+        parts[suffix] = (int(offset), int(size))
+    return parts
+
+
+def lock_segment(path):
+    """Return path opened and locked against writers and other
+    compactions, None if it is in use."""
+    if path in _active:
+        return None
+    fh = open(path, "ab")
+    if fcntl is not None:
+        try:
+            fcntl.lockf(fh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            fh.close()
+            return None
+    return fh
+
+
+class SegmentWriter(object):
+    """Append-only segment file owned by a single writer.
+
+    Page ids are made of the segment id and a counter, segment ids are
+    claimed exclusively so writers never need to agree on page ids.
+    The segment is locked while active so that compaction leaves it alone.
+    """
+
+    def __init__(self, segdir, minid=1):
+        os.makedirs(segdir, exist_ok=True)
+        self.segid = claim_segment(segdir, minid)
+        self.path = segment_path(segdir, self.segid)
+        self.fh = open(self.path, "ab")
+        if fcntl is not None:
+            fcntl.lockf(self.fh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        _active.add(self.path)
+        self.npages = 0
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return "SegmentWriter(%r)" % self.path
+
+    @property
+    def size(self):
+        return self.fh.tell()
+
+    def new_pageid(self):
+        with self._lock:
+            self.npages += 1
+            return (self.segid << 32) + self.npages
+
+    def write(self, parts):
+        # append (suffix, buffers) parts, return {suffix: (offset, size)}
+        out = {}
+        with self._lock:
+            for suffix, buffers in parts:
+                offset = self.fh.tell()
+                for data in buffers:
+                    self.fh.write(data)
+                out[suffix] = (offset, self.fh.tell() - offset)
+            self.fh.flush()
+        return out
+
+    def add(self, page, parts):
+        # store the parts of page, return the page read from the segment
+        spage = SegmentPage.__new__(SegmentPage)
+        spage.__dict__.update(page.__dict__)
+        spage.segment = self.segid
+        spage.segpath = self.path
+        spage.parts = self.write(parts)
+        return spage
+
+    def close(self):
+        _active.discard(self.path)
+        self.fh.close()
+
+
+class SegmentPage(Page):
+    """Page stored in a segment file, parts maps the suffix of each page
+    file to its (offset, size) in the segment."""
+
+    def __init__(self, segment, segpath, parts, *args, **kwargs):
+        self.segment = segment
+        self.segpath = segpath
+        self.parts = parts
+        Page.__init__(self, *args, **kwargs)
+
+    def _part(self, path):
+        suffix = path[len(self.idxpath) - len(".idx") :]
+        if suffix not in self.parts:
+            msg = "Error: Page %s has no %s in %s"
+            raise IOError(msg % (self.pageid, suffix, self.segpath))
+        return self.parts[suffix]
+
+    def _exists(self, path):
+        return path[len(self.idxpath) - len(".idx") :] in self.parts
+
+    def _fromfile(self, path, dtype, count, offset=0):
+        start, size = self._part(path)
+        dtype = np.dtype(dtype)
+        avail = max((size - offset) // dtype.itemsize, 0)
+        count = avail if count < 0 else min(count, avail)
+        if self.mmap and count > 0:
+            return np.memmap(
+                self.segpath,
+                dtype=dtype,
+                mode="r",
+                offset=start + offset,
+                shape=(count,),
+            )
+        return np.fromfile(
+            self.segpath, dtype=dtype, count=count, offset=start + offset
+        )
+
+    def _read_bytes(self, path, offset=0, size=-1):
+        start, psize = self._part(path)
+        if size < 0 or offset + size > psize:
+            size = max(psize - offset, 0)
+        return read_bytes(self.segpath, start + offset, size)
+
+    def _readinto(self, path, out, offset=0):
+        start, size = self._part(path)
+        if offset + out.nbytes > size:
+            msg = "Error in Page %s: not enough bytes in %s:%d!=%d"
+            raise IOError(msg % (self.pageid, path, size - offset, out.nbytes))
+        return Page._readinto(self, self.segpath, out, start + offset)
+
+    def _hash(self, sha, path, size=-1):
+        sha.update(self._read_bytes(path, 0, size))
+        return sha
+
+    def _mtime(self):
+        return os.path.getmtime(self.segpath)
+
+    def can_append(self, idxtype, rectype, reclen):
+        return False
+
+    def delete(self):
+        # the space is reclaimed by PageStore.compact_segments
+        pass
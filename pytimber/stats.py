@@ -0,0 +1,107 @@
+from collections import namedtuple
+
+import numpy as np
+
+Stat = namedtuple(
+    "Stat",
+    [
+        "MinTstamp",
+        "MaxTstamp",
+        "ValueCount",
+        "MinValue",
+        "MaxValue",
+        "AvgValue",
+        "StandardDeviationValue",
+    ],
+)
+
+# per page statistics stored in the catalog
+STAT_FIELDS = ("vmin", "vmax", "vsum", "vsumsq", "nnan")
+
+
+def page_stats(rec):
+    """Return (min, max, sum, sum of squares, NaN count) of numeric
+    scalar records, None for other records."""
+    rec = np.asarray(rec) if isinstance(rec, np.ndarray) else None
+    if rec is None or rec.ndim != 1 or rec.dtype.kind not in "biuf":
+        return None
+    val = rec.astype(float)
+    nan = np.isnan(val)
+    nnan = int(nan.sum())
+    if nnan > 0:
+        val = val[~nan]
+    if len(val) == 0:
+        return (None, None, 0.0, 0.0, nnan)
+    vmin, vmax = float(val.min()), float(val.max())
+    return (vmin, vmax, float(val.sum()), float(np.dot(val, val)), nnan)
+
+
+def combine_stats(stats):
+    # stats of the union of the records of several pages
+    vmin = [ss[0] for ss in stats if ss[0] is not None]
+    vmax = [ss[1] for ss in stats if ss[1] is not None]
+    return (
+        min(vmin) if vmin else None,
+        max(vmax) if vmax else None,
+        sum(ss[2] for ss in stats),
+        sum(ss[3] for ss in stats),
+        sum(ss[4] for ss in stats),
+    )
+
+
+def to_stat(tmin, tmax, count, stats):
+    # Stat as returned by LoggingDB.getStats, count includes NaN values
+    vmin, vmax, vsum, vsumsq, nnan = stats
+    nval = count - nnan
+    if nval <= 0:
+        return Stat(tmin, tmax, 0, np.nan, np.nan, np.nan, np.nan)
+    avg = vsum / nval
+    std = np.sqrt(max(vsumsq / nval - avg**2, 0.0))
+    return Stat(tmin, tmax, int(nval), vmin, vmax, avg, std)
+
+
+def _nan(stats):
+    return stats[4] > 0
+
+
+# op: (test on the values, test on the page stats telling if a value
+# of the page could pass)
+_predicates = {
+    ">": (lambda x, a: x > a, lambda s, a: s[1] is not None and s[1] > a),
+    ">=": (lambda x, a: x >= a, lambda s, a: s[1] is not None and s[1] >= a),
+    "<": (lambda x, a: x < a, lambda s, a: s[0] is not None and s[0] < a),
+    "<=": (lambda x, a: x <= a, lambda s, a: s[0] is not None and s[0] <= a),
+    "==": (
+        lambda x, a: x == a,
+        lambda s, a: s[0] is not None and s[0] <= a <= s[1],
+    ),
+    "!=": (
+        lambda x, a: x != a,
+        lambda s, a: _nan(s) or s[0] is None or not s[0] == s[1] == a,
+    ),
+    "between": (
+        lambda x, a, b: (x >= a) & (x <= b),
+        lambda s, a, b: s[0] is not None and s[1] >= a and s[0] <= b,
+    ),
+    "outside": (
+        lambda x, a, b: (x < a) | (x > b),
+        lambda s, a, b: s[0] is not None and (s[0] < a or s[1] > b),
+    ),
+}
+
+
+def parse_predicate(predicate):
+    """Return (test, may_match) for predicate.
+
+    predicate is (op, value) with op in >, >=, <, <=, ==, != or
+    ("between"|"outside", low, high), test(values) gives a boolean array
+    and may_match(stats) is False for pages without matching values.
+    A callable predicate is used as test and never excludes a page.
+    """
+    if callable(predicate):
+        return predicate, lambda stats: True
+    op, args = predicate[0], tuple(predicate[1:])
+    if op not in _predicates:
+        raise ValueError("Unknown predicate operator %r" % (op,))
+    test, may_match = _predicates[op]
+    return (lambda x: test(x, *args)), (lambda stats: may_match(stats, *args))
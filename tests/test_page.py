@@ -1,4 +1,9 @@
+import os
+
 from pytimber.pagestore import Page
+from pytimber import page as pagemod
+from pytimber.ragged import RaggedArray
+from pytimber import pagecodec
 from numpy import zeros, arange, random, array, all
 
 
@@ -11,7 +16,11 @@ def mktest(idx, rec, comp=None):
         nrec = p.get_rec_all()
         print(nidx)
         print(nrec)
-        assert all(nrec == rec)
+        assert p.checksum is None or p.check()
+        if isinstance(nrec, RaggedArray):
+            assert nrec.to_list() == [list(rrr) for rrr in rec]
+        else:
+            assert all(nrec == rec)
         assert all(nidx == idx)
     finally:
         p.delete()
@@ -49,3 +58,138 @@ def test_page():
     idx, rec = makedata(30, 80, 0)
     mktest(idx, rec)
     mktest(idx, rec, comp="gzip")
+    mktest(idx, rec, comp="zlib")
+    mktest(idx, rec, comp="lzma+shuffle")
+    mktest([1, 2], [["a", "b"], ["c", "d", "e"]], comp="zlib")
+
+
+def test_page_mmap():
+    idx, rec = arange(40), random.rand(40, 4)
+    p = Page.from_data(idx, rec, ".", 0)
+    try:
+        pm = Page(".", *p._tolist()[:9], p.checksum, mmap=True)
+        nidx, nrec = pm.get_all()
+        assert all(nrec == rec)
+        assert all(nidx == idx)
+        nidx, nrec = pm.get(10, 19)
+        assert all(nrec == rec[10:20])
+    finally:
+        p.delete()
+
+
+def test_page_get_range():
+    idx, rec = makedata(30, 5, 10)
+    p = Page.from_data(idx, rec, ".", 0)
+    try:
+        for a, b in [(0, 29), (3, 7), (10, 10), (28, 40), (-5, 2)]:
+            nidx, nrec = p.get(a, b)
+            sel = (idx >= a) & (idx <= b)
+            assert all(nidx == idx[sel])
+            assert len(nrec) == sel.sum()
+            for r1, r2 in zip(nrec, array(rec, dtype=object)[sel]):
+                assert all(r1 == r2)
+    finally:
+        p.delete()
+    idx, rec = arange(40), random.rand(40, 4)
+    p = Page.from_data(idx, rec, ".", 0)
+    try:
+        nidx, nrec = p.get(5, 12)
+        assert all(nrec == rec[5:13])
+    finally:
+        p.delete()
+
+
+def test_page_recsize():
+    idx, rec = makedata(30, 5, 10)
+    p = Page.from_data(idx, rec, ".", 0)
+    try:
+        assert p.get_recsize(idx[0], idx[-1]) == p.recsize
+        nbytes = sum(len(rrr) for rrr in rec[3:8]) * 8
+        assert p.get_recsize(idx[3], idx[7]) == nbytes
+        os.unlink(p.offpath)
+        assert p.get_recsize(idx[3], idx[7]) == nbytes
+        assert all(p.get_rec(3, 4)[0] == rec[3])
+    finally:
+        p.delete()
+
+
+def test_page_comp_blocks():
+    pagecodec.BLOCKSIZE = 64
+    try:
+        idx, rec = arange(300), random.rand(300, 3)
+        p = Page.from_data(idx, rec, ".", 0, comp="zlib+shuffle")
+        try:
+            assert p.check()
+            assert all(p.get_rec_all() == rec)
+            assert all(p.get_rec(17, 123) == rec[17:123])
+            nidx, nrec = p.get(250, 400)
+            assert all(nrec == rec[250:])
+        finally:
+            p.delete()
+        idx, rec = makedata(50, 2, 10)
+        p = Page.from_data(idx, rec, ".", 0, comp="zlib")
+        try:
+            nrec = p.get_rec(20, 40)
+            for r1, r2 in zip(nrec, rec[20:40]):
+                assert all(r1 == r2)
+        finally:
+            p.delete()
+    finally:
+        pagecodec.BLOCKSIZE = 2 ** 20
+
+
+def test_page_checksum():
+    idx, rec = arange(30), random.rand(30, 3)
+    p = Page.from_data(idx, rec, ".", 0)
+    try:
+        assert p.checksum.startswith(pagemod.HASH + pagemod.PARTS + ":")
+        # pages written before the algorithm prefix use md5
+        legacy = p.get_checksum("md5")
+        assert ":" not in legacy
+        p.checksum = legacy
+        assert p.check()
+        p.checksum = p.get_checksum(pagemod.HASH + pagemod.PARTS)
+        with open(p.recpath, "r+b") as fh:
+            fh.write(b"corrupted")
+        assert p.verify("once")
+        assert p.verify("never")
+        assert not p.verify("always")
+        pagemod._verified.clear()
+        assert not p.verify("once")
+        # only the most recently verified pages are remembered
+        size = pagemod._verified_size
+        try:
+            pagemod._verified_size = 2
+            for key in range(5):
+                pagemod._verified[key] = True
+            p.checksum = p.get_checksum(pagemod.HASH + pagemod.PARTS)
+            assert p.verify("once")
+            assert len(pagemod._verified) == 2
+            assert list(pagemod._verified)[-1] == (p.idxpath, p.checksum)
+        finally:
+            pagemod._verified_size = size
+            pagemod._verified.clear()
+    finally:
+        p.delete()
+
+
+def test_page_append_checksum():
+    rag = [arange(i % 3) for i in range(10)]
+    p = Page.from_data(arange(10), rag, ".", 0)
+    try:
+
+        def rehash(*args):
+            raise AssertionError("page files hashed again")
+
+        # only the appended bytes are hashed
+        p._hash = rehash
+        p.append(arange(10, 20), rag)
+        del p._hash
+        assert p.checksum == p.get_checksum()
+        # pages written by another process are hashed once
+        pagemod._states.clear()
+        p.append(arange(20, 30), rag)
+        assert p.checksum == p.get_checksum()
+        assert p.get_rec(25, 30).to_list() == [[0, 1], [], [0], [0, 1], []]
+    finally:
+        p.delete()
@@ -1,5 +1,12 @@
-from pytimber.pagestore import PageStore
+import os
+import sqlite3
+import threading
+import multiprocessing
 
+from pytimber.pagestore import PageStore, merge
+from pytimber.ragged import RaggedArray
+from pytimber.segment import list_segments
+from numpy import arange, array, all, isnan, concatenate, int64
 
 """
 def test_list():
@@ -18,3 +25,689 @@ def test_list():
     finally:
         db.delete()
 """
+
+
+def test_merge():
+    idx, rec = merge(
+        array([1, 3, 5]), array([10, 30, 50]), array([3, 4]), array([31, 41])
+    )
+    assert all(idx == [1, 3, 4, 5])
+    assert all(rec == [10, 31, 41, 50])
+    rec0 = RaggedArray.from_list([[1], [3, 3], [5]])
+    idx, rec = merge(array([1, 3, 5]), rec0, array([0, 5]), [[0, 0], [6]])
+    assert all(idx == [0, 1, 3, 5])
+    assert rec.to_list() == [[0, 0], [1], [3, 3], [6]]
+
+
+def test_append():
+    db = PageStore("test.db", "testdata", maxpagesize=800)
+    try:
+        for i in range(0, 300, 30):
+            db.store_variable("v1", arange(i, i + 30), arange(i, i + 30.0))
+            rag = [arange(j % 7) for j in range(i, i + 30)]
+            db.store_variable("v2", arange(i, i + 30), rag)
+        pages = db.get_pages("v1")
+        assert len(pages) == 3
+        assert [pp[2] for pp in pages] == [100, 100, 100]
+        idx, rec = db.get_variable("v1")
+        assert all(idx == arange(300))
+        assert all(rec == arange(300.0))
+        idx, rec = db.get_variable("v2", 95, 105)
+        assert rec.to_list() == [list(range(j % 7)) for j in range(95, 106)]
+        for pagedata in db.get_pages("v2"):
+            assert db._page(pagedata).check()
+        db.store_variable("v3", [1, 2], [["a", "bc"], ["d"]])
+        db.store_variable("v3", [3, 4], [["e", "f"], ["g", "h"]])
+        rec = db.get_variable("v3")[1]
+        assert [list(rr) for rr in rec] == [
+            ["a", "bc"],
+            ["d"],
+            ["e", "f"],
+            ["g", "h"],
+        ]
+        # only the empty records fit in the ragged tail page
+        db.store_variable("v4", arange(3), [arange(90), arange(3), arange(4)])
+        db.store_variable(
+            "v4", arange(3, 13), [arange(0)] * 4 + [arange(9)] * 6
+        )
+        rec = db.get_variable("v4")[1]
+        assert [len(rr) for rr in rec] == [90, 3, 4] + [0] * 4 + [9] * 6
+        assert db._page(db.get_pages("v4")[0]).count == 7
+    finally:
+        db.delete()
+
+
+def test_append_compressed():
+    # compressed tail pages cannot be appended to, the pages cut by each
+    # store are merged instead
+    db = PageStore("test.db", "testdata", comp="zlib")
+    try:
+        for i in range(0, 300, 10):
+            db.store({"v1": (arange(i, i + 10), arange(i, i + 10.0))})
+        assert len(db.get_pages("v1")) == 1
+        assert all(db.get_variable("v1")[1] == arange(300.0))
+    finally:
+        db.delete()
+
+
+def test_blob_bounds():
+    db = PageStore("test.db", "testdata", maxpagesize=800)
+    try:
+        db.store({"v1": (arange(100), arange(100.0))})
+        db.close()
+        # catalogs written before toscalar bound numpy scalars as blobs
+        con = sqlite3.connect("test.db")
+        sql = "UPDATE pages SET idxa=?,idxb=?"
+        con.execute(sql, [int64(0).tobytes(), int64(99).tobytes()])
+        con.execute("DROP TABLE variables")
+        con.execute("DELETE FROM conf WHERE variable=='scalarbounds'")
+        con.commit()
+        con.close()
+        db = PageStore("test.db", "testdata")
+        db.store({"v1": (arange(100, 110), arange(100.0, 110))})
+        assert all(db.get_variable("v1")[1] == arange(110.0))
+        assert db.get_summary()["v1"]["idxb"] == 109
+        sql = "SELECT COUNT(*) FROM pages WHERE typeof(idxa)=='blob'"
+        assert db.db.execute(sql).fetchone()[0] == 0
+    finally:
+        db.delete()
+
+
+def test_append_failure():
+    db = PageStore("test.db", "testdata", verify="always")
+    try:
+        db.store({"v1": (arange(10), arange(10.0))})
+
+        def locked(page):
+            raise sqlite3.OperationalError("database is locked")
+
+        db._update_page = locked
+        try:
+            db.store({"v1": (arange(10, 20), arange(10.0))})
+        except sqlite3.OperationalError:
+            pass
+        del db._update_page
+        # files longer than the catalog says do not fail the checksum
+        page = db._page(db.get_pages("v1")[0])
+        page.append(arange(10, 20), arange(10.0))
+        assert all(db.get_variable("v1")[1] == arange(10.0))
+        db.store({"v1": (arange(20, 30), arange(10.0))})
+        idx, rec = db.get_variable("v1")
+        assert all(idx == array(list(range(10)) + list(range(20, 30))))
+        assert all(rec == array(list(range(10)) * 2, dtype=float))
+    finally:
+        db.delete()
+
+
+def test_bulk_store():
+    db = PageStore("test.db", "testdata", maxpagesize=1600)
+    try:
+        data = {}
+        for i in range(20):
+            data["v%02d" % i] = (arange(100.0), arange(100.0) * i)
+        db.bulk_store(data, workers=4)
+        assert len(db.search("v%")) == 20
+        with db.bulk():
+            for i in range(20):
+                db.store_variable("v%02d" % i, arange(50.0, 60), -arange(10.0))
+        idx, rec = db.get_variable("v03")
+        assert all(idx == arange(100.0))
+        assert all(rec[50:60] == -arange(10.0))
+        assert len(db.get_pages("v03")) == 1
+        try:
+            with db.bulk():
+                db.store_variable("v03", arange(100.0, 110), arange(10.0))
+                db.store_variable("w", arange(10.0), arange(10.0))
+                raise KeyboardInterrupt
+        except KeyboardInterrupt:
+            pass
+        assert db.search("w") == []
+        assert db.count("v03") == 100
+        assert db._page(db.get_pages("v03")[0]).check()
+    finally:
+        db.delete()
+
+
+def test_bulk_staging():
+    db = PageStore("test.db", "testdata", maxpagesize=80, levels=[5, 10])
+    other = PageStore("test.db", "testdata", maxpagesize=80, timeout=0.1)
+    try:
+        db.store({"v1": (arange(5), arange(5.0))})
+        with db.bulk():
+            for i in range(5, 50, 5):
+                db.store_variable("v1", arange(i, i + 5), arange(i, i + 5.0))
+            db.store_variable("v2", arange(10), arange(10.0))
+            # page files are written, the catalog is not locked yet
+            assert not db.db.in_transaction
+            other.store({"w": (arange(10), arange(10.0))})
+        assert all(db.get_variable("v1")[1] == arange(50.0))
+        assert max(pp[7] for pp in db.get_pages("v1")) <= 80
+        assert len(db.get_variable("@10:v1")[0]) == 5
+        assert all(other.get_variable("v2")[1] == arange(10.0))
+        assert db.search() == ["v1", "v2", "w"]
+    finally:
+        other.close()
+        db.delete()
+
+
+def test_get_pages():
+    db = PageStore("test.db", "testdata", maxpagesize=80)
+    try:
+        db.store({"v1": (arange(200.0), arange(200.0))})
+        lims = [pp[3:5] for pp in db.get_pages("v1", 35, 52)]
+        assert lims == [(30, 39), (40, 49), (50, 59)]
+        lims = [pp[3:5] for pp in db.get_pages("v1", 35.5, 39.5)]
+        assert lims == [(30, 39)]
+        assert db.get_pages("v1", 300, 400) == []
+        assert len(db.get_pages("v1")) == 20
+    finally:
+        db.delete()
+
+
+def test_summary():
+    db = PageStore("test.db", "testdata", maxpagesize=80)
+    try:
+        db.store({"v1": (arange(200.0), arange(200.0))})
+        db.store({"v2": (arange(10.0), arange(10.0))})
+        db.store({"v1": (arange(200.0, 205), arange(5.0))})
+        db.store({"v1": (arange(10.5, 12), arange(2.0))})
+        info = db.get_summary()
+        assert sorted(info) == ["v1", "v2"]
+        assert info["v1"]["count"] == 207
+        assert info["v1"]["recsize"] == 207 * 8
+        assert info["v1"]["npages"] == len(db.get_pages("v1"))
+        assert (info["v1"]["idxa"], info["v1"]["idxb"]) == (0, 204)
+        assert db.count("v1") == 207
+        for pagedata in db.get_pages("v1")[:3]:
+            db.delete_page(db._page(pagedata))
+        assert db.get_lim("v1")[0] == db.get_pages("v1")[0][3]
+        db.delete_variable("v2")
+        assert db.search() == ["v1"]
+        assert "1 variables" in db.get_info()
+    finally:
+        db.delete()
+
+
+def test_readonly():
+    db = PageStore("test.db", "testdata")
+    try:
+        db.store({"v1": (arange(20.0), arange(20.0))})
+        rodb = PageStore("test.db", "testdata", readonly=True)
+        assert rodb.dbname == "test.db"
+        assert rodb.pagedir == db.pagedir
+        assert all(rodb.get_variable("v1")[1] == arange(20.0))
+        nfiles = sum(len(files) for _, _, files in os.walk("testdata"))
+        try:
+            rodb.store({"v2": (arange(20.0), arange(20.0))})
+            assert False
+        except ValueError:
+            pass
+        # nothing is written to the pagedir
+        assert sum(len(ff) for _, _, ff in os.walk("testdata")) == nfiles
+        db.db.execute("DROP TABLE variables")
+        db.db.commit()
+        rodb = PageStore("test.db", "testdata", readonly="immutable")
+        assert rodb.search() == ["v1"]
+        assert rodb.count("v1") == 20
+    finally:
+        db.delete()
+
+
+def _store_worker(name):
+    db = PageStore("test.db", "testdata", maxpagesize=80)
+    for i in range(0, 100, 10):
+        db.store({name: (arange(i, i + 10.0), arange(i, i + 10.0))})
+
+
+def test_concurrent_writers():
+    db = PageStore("test.db", "testdata", maxpagesize=80)
+    try:
+        names = ["v%d" % i for i in range(4)]
+        with multiprocessing.Pool(4) as pool:
+            pool.map(_store_worker, names)
+        assert db.search() == names
+        for name in names:
+            assert all(db.get_variable(name)[1] == arange(100.0))
+        sql = "SELECT COUNT(pageid),COUNT(DISTINCT pageid) FROM pages"
+        npages, nids = db.db.execute(sql).fetchone()
+        assert npages == nids
+    finally:
+        db.delete()
+
+
+def test_threads():
+    db = PageStore("test.db", "testdata", maxpagesize=80, workers=4)
+    try:
+        names = ["v%d" % i for i in range(4)]
+        threads = [
+            threading.Thread(target=db.store_variable, args=(name, *data))
+            for name, data in zip(names, [(arange(100), arange(100.0))] * 4)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        db.store({"r": (arange(100), [arange(i % 7) for i in range(100)])})
+        out = db.get(names + ["r"], 5, 94)
+        for name in names:
+            assert all(out[name][0] == arange(5, 95))
+            assert all(out[name][1] == arange(5.0, 95.0))
+        assert len(out["r"][1]) == 90
+        assert out["r"][1][3].tolist() == list(range(8 % 7))
+        assert all(db.get_variable("v0")[1] == arange(100.0))
+    finally:
+        db.delete()
+
+
+def test_scrub():
+    db = PageStore("test.db", "testdata", maxpagesize=80, verify="always")
+    try:
+        db.store({"v1": (arange(100), arange(100.0))})
+        assert db.scrub() == []
+        page = db._page(db.get_pages("v1")[0])
+        with open(page.recpath, "r+b") as fh:
+            fh.write(b"corrupted")
+        assert db.scrub() == [page.pageid]
+        try:
+            db.get_variable("v1")
+            assert False
+        except IOError:
+            pass
+        db.verify = "never"
+        assert len(db.get_variable("v1")[0]) == 100
+    finally:
+        db.delete()
+
+
+def test_cache():
+    db = PageStore("test.db", "testdata", maxpagesize=80, cache=400)
+    try:
+        db.store({"v1": (arange(100), arange(100.0))})
+        # 160 bytes per page, the budget holds two
+        assert all(db.get_variable("v1", 15, 24)[1] == arange(15.0, 25.0))
+        stats = db.cache.stats()
+        assert stats["misses"] == 2 and stats["hits"] == 0
+        assert all(db.get_variable("v1", 15, 24)[1] == arange(15.0, 25.0))
+        assert db.cache.stats()["hits"] == 2
+        assert all(db.get_variable("v1")[1] == arange(100.0))
+        assert len(db.cache) == 2 and db.cache.nbytes <= 400
+        db.store({"v1": (array([95]), array([-1.0]))})
+        rec = db.get_variable("v1", 95, 95)[1]
+        assert rec[0] == -1.0
+        assert rec.flags.writeable is False
+    finally:
+        db.delete()
+
+
+def test_levels():
+    db = PageStore("test.db", "testdata", maxpagesize=800, levels=[10, 100])
+    try:
+        db.store({"v1": (arange(0, 500), arange(0, 500.0))})
+        db.store({"v1": (arange(500, 1000), arange(500, 1000.0))})
+        db.store({"s": (arange(3), ["a", "b", "c"])})
+        assert db.search() == ["s", "v1"]
+        idx, rec = db.get_variable("v1", resolution=10)
+        assert all(idx == arange(0, 1000, 10))
+        assert all(rec[:, 0] == arange(0, 1000, 10))
+        assert all(rec[:, 1] == arange(9, 1000, 10))
+        assert all(rec[:, 3] == 10)
+        idx, rec = db.get_variable("v1", 250, 749, maxpoints=6)
+        assert all(idx == [200, 300, 400, 500, 600, 700])
+        assert rec[0, 2] == 249.5 and rec[-1, 5] == 799
+        assert len(db.get_variable("v1", 0, 30, maxpoints=100)[0]) == 31
+        db.store({"v1": (array([55]), array([-1.0]))})
+        rec = db.get_variable("v1", 0, 99, resolution=100)[1]
+        assert rec[0, 0] == -1.0 and rec[0, 3] == 100
+        assert db.get_variable("s", resolution=10)[1][2] == "c"
+        with db.bulk():
+            db.store_variable("w", arange(10), arange(10.0))
+            db.update_levels("v1", 0, 99)
+            # the variables stored in the bulk stay staged
+            assert "w" in db._bulk["staged"]
+        assert len(db.get_variable("w", resolution=10)[0]) == 1
+        db.delete_variable("v1")
+        db.delete_variable("w")
+        assert db.search("@%") == []
+        val = arange(100.0)
+        val[3] = float("nan")
+        db.store({"n": (arange(100), val)})
+        for resolution in [10, 100]:
+            rec = db.get_variable("n", 0, 9, resolution=resolution)[1]
+            count = resolution - 1
+            assert rec[0, :2].tolist() == [0, resolution - 1]
+            assert rec[0, 2] == (resolution * count / 2 - 3) / count
+            assert rec[0, 3] == count
+        try:
+            db.set_levels([10, 15])
+            assert False
+        except ValueError:
+            pass
+        db.set_levels([10])
+        db.set_levels()
+        assert db.levels == [10.0]
+    finally:
+        db.delete()
+
+
+def test_stats():
+    db = PageStore("test.db", "testdata", maxpagesize=80)
+    try:
+        val = arange(100.0)
+        val[42] = float("nan")
+        db.store({"v1": (arange(100), val)})
+        db.store({"v1": (arange(100, 105), arange(100, 105.0))})
+        db.store({"v1": (arange(105, 108), arange(105, 108.0))})
+        db.store({"v2": (arange(3), [[1, 2], [3, 4], [5, 6]])})
+        sql = "SELECT COUNT(*) FROM pages WHERE vsum IS NOT NULL"
+        assert db.db.execute(sql).fetchone()[0] == 11
+        stat = db.stats("v1", 15, 64)
+        ref = val[15:65][~isnan(val[15:65])]
+        assert stat.MinTstamp == 15 and stat.MaxTstamp == 64
+        assert stat.ValueCount == 49
+        assert stat.MinValue == 15 and stat.MaxValue == 64
+        assert abs(stat.AvgValue - ref.mean()) < 1e-12
+        assert abs(stat.StandardDeviationValue - ref.std()) < 1e-9
+        assert db.stats("v1").MaxValue == 107
+        assert db.stats("v2") is None
+    finally:
+        db.delete()
+
+
+def test_find():
+    db = PageStore("test.db", "testdata", maxpagesize=80)
+    try:
+        val = (arange(100) % 50) * 1.0
+        db.store({"v1": (arange(100), val)})
+        assert all(db.find("v1", (">=", 47)) == [47, 48, 49, 97, 98, 99])
+        assert all(
+            db.find("v1", ("between", 18, 21), 0, 60) == [18, 19, 20, 21]
+        )
+        runs = db.find("v1", ("outside", 5, 44), intervals=True)
+        assert runs.tolist() == [[0, 4], [45, 54], [95, 99]]
+        reads = []
+        read_page = db._read_page
+        db._read_page = lambda *args: reads.append(args) or read_page(*args)
+        assert all(db.find("v1", ("==", 33)) == [33, 83])
+        assert len(reads) == 2
+        assert len(db.find("v1", lambda x: x < 0)) == 0
+        rag = [arange(i % 4) * 1.0 for i in range(100)]
+        db.store({"v2": (arange(100), rag)})
+        assert all(db.find("v2", (">=", 2)) == arange(3, 100, 4))
+        assert all(db.find("v2", ("<", 1), 0, 9) == [1, 2, 3, 5, 6, 7, 9])
+        runs = db.find("v2", ("==", 0), intervals=True)
+        assert runs.tolist()[:2] == [[1, 3], [5, 7]]
+    finally:
+        db.delete()
+
+
+def test_segments():
+    db = PageStore("test.db", "testdata", maxpagesize=80, segmentsize=1000)
+    try:
+        db.store({"v1": (arange(100), arange(100.0))})
+        db.store({"v2": (arange(20), [arange(i % 3) for i in range(20)])})
+        assert all(db.get_variable("v1", 5, 94)[1] == arange(5.0, 95.0))
+        assert db.get_variable("v2")[1][5].tolist() == [0, 1]
+        assert db.scrub() == []
+        nfiles = sum(len(files) for _, _, files in os.walk("testdata"))
+        assert nfiles < 10
+        # files from a store without segments stay readable
+        db.segmentsize = 0
+        db.store({"v3": (arange(10), arange(10.0))})
+        assert all(db.get_variable("v3")[1] == arange(10.0))
+        db.segmentsize = 1000
+        db.delete_variable("v1")
+        db.close()
+        db = PageStore("test.db", "testdata")
+        assert db.segmentsize == 1000
+        # readers may still use the pages just deleted
+        assert db.compact_segments() == 0
+        db.db.execute("UPDATE pages SET deleted=deleted-100 WHERE deleted")
+        db.db.commit()
+        before = list_segments(db.segdir)
+        assert db.compact_segments() > 0
+        assert db.get_variable("v2")[1][5].tolist() == [0, 1]
+        # compacted segments are deleted once grace has passed
+        sql = "SELECT DISTINCT segment FROM pages"
+        used = set(segid for segid, in db.db.execute(sql))
+        unused = [path for segid, path in before.items() if segid not in used]
+        assert len(unused) > 0 and all(map(os.path.exists, unused))
+        for path in unused:
+            os.utime(path, (0, 0))
+        assert db.compact_segments() == 0
+        assert not any(map(os.path.exists, unused))
+        assert db.count("v1") == 0
+        assert db.scrub() == []
+    finally:
+        db.delete()
+
+
+def test_segment_bulk():
+    db = PageStore("test.db", "testdata", segmentsize=500)
+    other = PageStore("test.db", "testdata", grace=0)
+    try:
+        with db.bulk():
+            for i in range(5):
+                db.store_variable("v%d" % i, arange(100), arange(100.0))
+            # full segments hold staged pages until the commit
+            assert other.compact_segments() == 0
+        assert len(list_segments(db.segdir)) == 5
+        for i in range(5):
+            assert all(db.get_variable("v%d" % i)[1] == arange(100.0))
+    finally:
+        other.close()
+        db.delete()
+
+
+def test_segment_compaction():
+    db = PageStore("test.db", "testdata", maxpagesize=800, segmentsize=10**6)
+    try:
+        # segment pages are never appended to, each store cuts a page
+        for i in range(30):
+            db.store({"v1": (arange(i * 10, i * 10 + 10), arange(10.0))})
+        pages = db.get_pages("v1")
+        assert len(pages) < 10
+        assert max(pp[7] for pp in pages) <= 800
+        assert all(db.get_variable("v1")[0] == arange(300))
+    finally:
+        db.delete()
+
+
+def test_compaction():
+    db = PageStore("test.db", "testdata", maxpagesize=800, compaction="size")
+    try:
+        # out of order stores make new pages instead of appending
+        for i in reversed(range(10)):
+            db.store({"v1": (arange(i * 10, i * 10 + 10), arange(10.0))})
+        assert db.compactor.wait(10)
+        assert len(db.get_pages("v1")) < 10
+        assert all(db.get_variable("v1")[0] == arange(100))
+        db.set_compaction("time", window=50)
+        for i in reversed(range(10, 20)):
+            db.store({"v2": (arange(i * 10, i * 10 + 10), arange(10.0))})
+        assert db.compactor.wait(10)
+        pages = db.get_pages("v2")
+        assert len(pages) == 2
+        assert [pp[4] // 50 for pp in pages] == [2, 3]
+        db.set_compaction(None)
+        db.store({"v3": (arange(10, 20), arange(10.0))})
+        db.store({"v3": (arange(10), arange(10.0))})
+        assert len(db.get_pages("v3")) == 2
+        assert db.compact_variable("v3") == (2, 1)
+    finally:
+        db.delete()
+
+
+def _read_worker(db, name, stop, errors):
+    while not stop.is_set():
+        try:
+            idx, rec = db.get_variable(name)
+            assert all(rec == idx % 10)
+        except Exception as exc:
+            errors.append(exc)
+
+
+def test_compaction_readers():
+    for compaction in ["size", "sync"]:
+        db = PageStore(
+            "test.db", "testdata", maxpagesize=800, compaction=compaction
+        )
+        try:
+            stop = threading.Event()
+            errors = []
+            reader = threading.Thread(
+                target=_read_worker, args=(db, "v1", stop, errors)
+            )
+            reader.start()
+            try:
+                for i in reversed(range(30)):
+                    data = (arange(i * 10, i * 10 + 10), arange(10.0))
+                    db.store({"v1": data})
+                if db.compactor is not None:
+                    assert db.compactor.wait(10)
+            finally:
+                stop.set()
+                reader.join()
+            assert errors == []
+            assert len(db.get_pages("v1")) < 30
+            sql = "SELECT COUNT(*) FROM pages WHERE deleted IS NOT NULL"
+            assert db.db.execute(sql).fetchone()[0] > 0
+            db.prune_delete_pages()
+            assert db.vacuum(dryrun=True)["missing"] == []
+        finally:
+            db.delete()
+
+
+def test_rewrite_pages():
+    db = PageStore("test.db", "testdata", maxpagesize=0)
+    try:
+        vec = arange(1000.0).reshape(100, 10)
+        rag = [arange(i % 7) for i in range(100)]
+        db.store({"v1": (arange(100), vec), "v2": (arange(100), rag)})
+        db.split_pages("v1", 2000)
+        db.split_pages("v2", 500)
+        pages = db.get_pages("v1")
+        assert len(pages) == 4
+        assert max(pp[7] for pp in pages) <= 2000
+        assert all(db.get_variable("v1")[1] == vec)
+        assert max(pp[7] for pp in db.get_pages("v2")) <= 500
+        out = db.get_variable("v2")[1]
+        assert [list(rr) for rr in out] == [list(rr) for rr in rag]
+        pages = [db._page(pp) for pp in db.get_pages("v1")]
+        db.merge_pages("v1", pages, 3000)
+        assert [pp[2] for pp in db.get_pages("v1")] == [33, 33, 34]
+        assert all(db.get_variable("v1")[1] == vec)
+    finally:
+        db.delete()
+
+
+def test_vacuum():
+    db = PageStore("test.db", "testdata", keep_deleted_pages=True, grace=0)
+    try:
+        db.store({"v1": (arange(10), arange(10.0))})
+        db.store({"v2": (arange(10), arange(10.0))})
+        db.store({"v3": (arange(10), arange(10.0))})
+        db.delete_variable("v1")
+        db.db.execute("UPDATE pages SET deleted=deleted-10 WHERE deleted")
+        db.db.commit()
+        orphan = os.path.join(db.pagedir, "0999", "999.idx")
+        os.makedirs(os.path.dirname(orphan))
+        open(orphan, "wb").write(b"x" * 100)
+        os.utime(orphan, (0, 0))
+        page = db._page(db.get_pages("v3")[0])
+        os.unlink(page.recpath)
+        report = db.vacuum(dryrun=True)
+        assert list(report["variables"]) == ["v1"]
+        assert report["variables"]["v1"] == 160
+        assert report["orphans"] == [orphan]
+        assert report["missing"] == [page.pageid]
+        assert os.path.exists(orphan)
+        report = db.vacuum(grace=0)
+        assert report["dirs"] == 1
+        assert not os.path.exists(orphan)
+        sql = "SELECT COUNT(*) FROM pages"
+        assert db.db.execute(sql).fetchone()[0] == 2
+        assert all(db.get_variable("v2")[1] == arange(10.0))
+        assert db.vacuum(dryrun=True)["variables"] == {}
+    finally:
+        db.delete()
+
+
+def test_partition():
+    db = PageStore("test.db", "testdata", maxpagesize=1000, partition=10)
+    try:
+        db.store({"v1": (arange(35), arange(35.0))})
+        db.store({"v1": (arange(35, 45), arange(35.0, 45))})
+        db.store({"v1": (array([12.5, 29.5]), array([0.0, 1.0]))})
+        pages = db.get_pages("v1")
+        assert [(pp[3], pp[4]) for pp in pages] == [
+            (0, 9),
+            (10, 19),
+            (20, 29.5),
+            (30, 39),
+            (40, 44),
+        ]
+        assert len(db.get_variable("v1", 0, 100)[0]) == 47
+        db.close()
+        db = PageStore("test.db", "testdata")
+        assert db.partition == ("every", 10.0)
+        assert db.drop_partitions(25) == 2
+        assert db.get_variable("v1")[0][0] == 20
+        db.set_partition([0, 100, 250])
+        db.store({"v2": (arange(0, 300, 10), arange(30.0))})
+        assert [pp[2] for pp in db.get_pages("v2")] == [10, 15, 5]
+    finally:
+        db.delete()
+
+
+def test_iter_variable():
+    db = PageStore("test.db", "testdata", maxpagesize=400)
+    try:
+        db.store({"v1": (arange(200), arange(200.0))})
+        db.store(
+            {"v2": (arange(0, 200, 7), [arange(i % 3) for i in range(29)])}
+        )
+        chunks = list(db.iter_variable("v1", 10.5, 150))
+        assert len(chunks) == 4
+        assert all(concatenate([cc[1] for cc in chunks]) == arange(11, 151))
+        chunks = list(db.iter_variable("v1", 10, 150, chunk_rows=30))
+        assert [len(cc[0]) for cc in chunks] == [30, 30, 30, 30, 21]
+        assert chunks[1][0][0] == 40
+        assert sum(cc[1].sum() for cc in db.iter_variable("v1")) == 19900
+        windows = list(db.iter_variables(["v1", "v2"], 50))
+        assert [start for start, data in windows] == [0, 50, 100, 150]
+        assert all(windows[1][1]["v1"][0] == arange(50, 100))
+        assert windows[1][1]["v2"][0].tolist() == list(range(56, 100, 7))
+        windows = list(db.iter_variables("v%", 10, 300, 500))
+        assert windows == []
+    finally:
+        db.delete()
+
+
+def test_get_aligned():
+    db = PageStore("test.db", "testdata", maxpagesize=80)
+    try:
+        db.store({"m": (arange(10, 50, 2.5), arange(16))})
+        db.store({"v1": (arange(0, 100, 10), arange(10.0))})
+        db.store({"v2": (array([30, 33]), [array([1, 2]), array([3])])})
+        out = db.get_aligned(["m", "v1", "v2"], 20, 35)
+        assert out["timestamps"].tolist() == [20, 22.5, 25, 27.5, 30, 32.5, 35]
+        assert out["v1"].tolist() == [2, 2, 2, 2, 3, 3, 3]
+        assert [rr if rr is None else rr.tolist() for rr in out["v2"]] == [
+            None,
+            None,
+            None,
+            None,
+            [1, 2],
+            [1, 2],
+            [3],
+        ]
+        out = db.get_aligned("%", 20, 35, master="m", method="next")
+        assert out["v1"].tolist() == [2, 3, 3, 3, 3, 4, 4]
+        out = db.get_aligned(["m", "v1"], 20, 35, method="nearest")
+        assert out["v1"].tolist() == [2, 2, 2, 3, 3, 3, 3]
+        out = db.get_aligned(["m", "v1"], 20, 35, method="linear")
+        assert out["v1"].tolist() == [2, 2.25, 2.5, 2.75, 3, 3.25, 3.5]
+        out = db.get_aligned(["m", "v1"], 20, 35, tolerance=1)
+        assert isnan(out["v1"]).tolist() == [0, 1, 1, 1, 0, 1, 1]
+    finally:
+        db.delete()
@@ -0,0 +1,43 @@
+from pytimber.ragged import RaggedArray, concatenate
+from numpy import arange, array, all, isnan, zeros
+
+
+def mkragged():
+    rec = [arange(3.0), arange(1.0), zeros(0), arange(4.0) + 10]
+    return rec, RaggedArray.from_list(rec)
+
+
+def test_ragged_access():
+    rec, rag = mkragged()
+    assert len(rag) == 4
+    assert all(rag.lengths == [3, 1, 0, 4])
+    for r1, r2 in zip(rag, rec):
+        assert all(r1 == r2)
+    assert all(rag[-1] == rec[-1])
+    assert rag[1:3].to_list() == [[0.0], []]
+    assert rag[::2].to_list() == [rec[0].tolist(), []]
+    assert rag[array([True, False, False, True])].to_list() == [
+        rec[0].tolist(),
+        rec[3].tolist(),
+    ]
+    assert rag.take([3, 0]).to_list() == [rec[3].tolist(), rec[0].tolist()]
+
+
+def test_ragged_concatenate():
+    rec, rag = mkragged()
+    out = concatenate([rag[1:], rag[:1]])
+    assert isinstance(out, RaggedArray)
+    assert out.to_list() == [rr.tolist() for rr in rec[1:] + rec[:1]]
+    out = concatenate([zeros((2, 3)), zeros((1, 2))])
+    assert isinstance(out, RaggedArray)
+    assert all(out.lengths == [3, 3, 2])
+
+
+def test_ragged_padded():
+    rec, rag = mkragged()
+    pad = rag.to_padded()
+    assert pad.shape == (4, 4)
+    assert all(pad[3] == rec[3])
+    assert isnan(pad[1, 1:]).all()
+    pad = rag[2:].to_padded(fill=-1, width=2)
+    assert all(pad == [[-1, -1], [10, 11]])